@@ -14,3 +14,45 @@ except ImportError:
     TULING_URL = ''
     # bot name
     BOT_NAME = ''
+
+# websocket permessage-deflate 压缩级别（1-9）及内存级别（1-9），为 0 时不启用压缩，服务端及监听服务共用
+WS_COMPRESSION_LEVEL = 6
+WS_COMPRESSION_MEM_LEVEL = 8
+# websocket 单条消息最大字节数，超出时接收方断开连接，发送方丢弃
+WS_MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# 事件分发最多同时处理的消息数
+DISPATCH_CONCURRENCY = 16
+# 事件分发队列上限，超出后所有消息均被丢弃
+DISPATCH_MAX_QUEUE = 1000
+# 队列积压超过该深度时丢弃对应类型的消息：plain 普通消息，mention 私聊及 @ 机器人的消息，命令消息只在队列满时丢弃
+DISPATCH_SHED_DEPTH = {'plain': 100, 'mention': 500}
+# 非命令消息排队超过该时间（秒）后不再处理
+DISPATCH_MAX_WAIT = 60
+# 处理名额按权重在命令、私聊及 @ 机器人、普通消息三个通道间轮流分配
+DISPATCH_LANE_WEIGHTS = {'command': 6, 'mention': 3, 'plain': 1}
+# 事件响应器默认运行时限（秒），为 None 时不限制；超时后回复 HANDLER_FALLBACK，为 None 时不回复
+HANDLER_TIMEOUT = 30
+HANDLER_FALLBACK = None
+# 暂停中的对话保存路径，为 None 时只保存在内存中；内存中最多保留 DIALOG_CACHE_SIZE 个，超过 DIALOG_TTL 秒未回复的对话自动结束
+DIALOG_STORE = 'data/dialogs.db'
+DIALOG_CACHE_SIZE = 1000
+DIALOG_TTL = 30 * 60
+# 重复消息过滤：DEDUP_WINDOW 秒内相同 id（或时间、发送者及内容）的消息只处理一次，没有 id 时同一秒内的相同内容视为重复，
+# DEDUP_CAPACITY 为单个窗口内预计的最多消息数，DEDUP_ERROR_RATE 为误判为重复的概率上限
+DEDUP_WINDOW = 300
+DEDUP_CAPACITY = 100000
+DEDUP_ERROR_RATE = 1e-6
+# 消息限流（只作用于事件分发，消息流及 websocket 推送不受影响）：每个发送者每秒 FLOOD_SENDER_RATE 条、最多连续 FLOOD_SENDER_BURST 条，每个群每秒 FLOOD_CHATROOM_RATE 条、
+# 最多连续 FLOOD_CHATROOM_BURST 条，命令及进行中的对话不受群限流影响；超出的消息按 FLOOD_POLICY 处理：drop 丢弃，sample 每 FLOOD_SAMPLE 条放行一条，
+# collapse 丢弃内容，只在该发送者下一条放行的消息中记录期间丢弃的条数；最多保留 FLOOD_MAX_KEYS 个发送者及群的令牌桶
+FLOOD_SENDER_RATE = 1
+FLOOD_SENDER_BURST = 5
+FLOOD_CHATROOM_RATE = 5
+FLOOD_CHATROOM_BURST = 20
+FLOOD_POLICY = 'drop'
+FLOOD_SAMPLE = 10
+FLOOD_MAX_KEYS = 10000
+# 连续消息合并（事件响应器设置 debounce 时启用）：最多合并的消息数及合并文本的分隔符
+DEBOUNCE_MAX_MESSAGES = 10
+DEBOUNCE_SEPARATOR = ' '
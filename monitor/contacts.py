@@ -0,0 +1,150 @@
+"""
+通讯录副本
+==========
+
+监听服务通过 websocket 接收微信服务推送的通讯录、群成员全量快照及增量变化，在本地维护一份只读副本，
+插件中可以直接同步查询好友、群聊名称及群成员，无需再请求 HTTP 接口。
+
+用法:
+
+.. code-block:: python
+
+    from monitor.contacts import contacts
+
+    @matcher.handle()
+    async def _(message):
+        name = contacts.name(message.user)
+        members = contacts.members_of(message.group)
+"""
+import threading
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from .logger import logger
+
+CONTACTS_EVENT = 'contacts'
+"""通讯录推送消息的 ``event`` 字段"""
+MEMBERS_EVENT = 'members'
+"""群成员推送消息的 ``event`` 字段"""
+
+
+class ContactReplica:
+    """
+    :说明:
+
+      通讯录本地副本，通过 ``apply`` 应用快照或增量变化。
+      快照总是直接覆盖本地副本；增量变化的版本不连续时调用 ``on_gap`` 请求重新同步快照。
+    """
+
+    def __init__(self):
+        self.version: int = -1
+        self.on_gap: Optional[Callable[[], Any]] = None
+        self._resyncing = False
+        self._contacts: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._members: Dict[str, FrozenSet[str]] = {}
+        self._rooms: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (f"<ContactReplica version={self.version}, "
+                f"{', '.join(f'{t}={len(c)}' for t, c in self._contacts.items())}>")
+
+    def apply(self, frame: Dict[str, Any]) -> bool:
+        """
+        :说明:
+
+          应用一次通讯录推送
+
+        :参数:
+
+          * ``frame: Dict[str, Any]``: 快照或增量变化
+
+        :返回:
+
+          - ``bool``: 是否成功应用，版本不连续时返回 ``False``
+        """
+        if frame.get('event') == MEMBERS_EVENT:
+            self._apply_members(frame)
+            return True
+
+        with self._lock:
+            version = frame.get('version', -1)
+            if frame.get('snapshot'):
+                self._contacts = {type_: dict(contacts) for type_, contacts in frame['contacts'].items()}
+                self.version = version
+                self._resyncing = False
+                logger.info(f'contact replica synced {self}')
+                return True
+
+            if version <= self.version:
+                return True
+            if self.version >= 0 and version != self.version + 1:
+                if not self._resyncing:
+                    logger.warning(f'contact replica version gap {self.version} -> {version}, resync')
+                    self._resyncing = True
+                    if self.on_gap:
+                        self.on_gap()
+                return False
+            for delta in frame.get('deltas', ()):
+                contacts = self._contacts.setdefault(delta['type'], {})
+                if delta['op'] == 'remove':
+                    contacts.pop(delta['wxid'], None)
+                else:
+                    contacts[delta['wxid']] = delta['info']
+            self.version = version
+            return True
+
+    def _apply_members(self, frame: Dict[str, Any]) -> None:
+        with self._lock:
+            if frame.get('snapshot'):
+                updates = frame['members']
+                self._members, self._rooms = {}, {}
+            else:
+                updates = {frame['chatroom']: frame['members']}
+            for chatroom, members in updates.items():
+                members = frozenset(members)
+                old = self._members.get(chatroom, frozenset())
+                for wxid in old - members:
+                    self._rooms.get(wxid, set()).discard(chatroom)
+                for wxid in members - old:
+                    self._rooms.setdefault(wxid, set()).add(chatroom)
+                self._members[chatroom] = members
+
+    def members_of(self, chatroom: str) -> FrozenSet[str]:
+        """获取群成员 wxid 集合，未缓存时为空"""
+        return self._members.get(chatroom, frozenset())
+
+    def chatrooms_of(self, wxid: str) -> FrozenSet[str]:
+        """获取成员所在的所有已缓存的群"""
+        return frozenset(self._rooms.get(wxid, ()))
+
+    def of_type(self, type_: str) -> Dict[str, Dict[str, Any]]:
+        """获取指定类型（``person`` | ``chatroom`` | ``gh``）的通讯录"""
+        return self._contacts.get(type_, {})
+
+    def get(self, wxid: str) -> Optional[Dict[str, Any]]:
+        """通过 wxid 获取通讯录信息"""
+        for contacts in self._contacts.values():
+            info = contacts.get(wxid)
+            if info is not None:
+                return info
+        return None
+
+    def name(self, wxid: str, default: Optional[str] = None) -> Optional[str]:
+        """获取备注名，无备注时返回昵称"""
+        info = self.get(wxid)
+        if not info:
+            return default
+        return info.get('remark_name') or info.get('name') or default
+
+    def lookup(self, name: str) -> List[Tuple[str, str]]:
+        """通过昵称或备注精确查找通讯录，返回 ``[(类型, wxid)]``"""
+        return [
+            (type_, wxid)
+            for type_, contacts in list(self._contacts.items())
+            for wxid, info in list(contacts.items())
+            if name in (info.get('name'), info.get('remark_name'))
+        ]
+
+
+contacts = ContactReplica()
+"""当前进程的通讯录副本"""
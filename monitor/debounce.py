@@ -0,0 +1,129 @@
+"""
+连续消息合并
+============
+
+设置了 ``debounce`` 的事件响应器匹配到消息后不立即运行，同一会话在 ``debounce`` 秒内继续发来的、
+同样匹配该事件响应器的消息会被合并，直到静默 ``debounce`` 秒后以合并后的文本运行一次，
+合并条数达到上限后新的消息开始下一次合并。
+
+用法:
+
+.. code-block:: python
+
+    chat = on_regex(r'.+', rule=to_me(), debounce=1.5)
+
+只在事件循环常驻时（单事件循环模式及监听服务）合并，合并在后台进行，不阻塞同一会话后续消息的分发，
+合并结束后占用一个分发名额运行；每条消息单独创建事件循环时不合并，直接运行，避免阻塞回调线程。
+"""
+import asyncio
+import threading
+import time
+from typing import Any, AsyncContextManager, Callable, Dict, Hashable, List, Optional, Tuple, TYPE_CHECKING
+
+from classes import Message
+from .config import DEBOUNCE_MAX_MESSAGES, DEBOUNCE_SEPARATOR
+from .logger import logger
+
+if TYPE_CHECKING:
+    from .matcher import Matcher
+
+
+class Burst:
+    """合并中的消息"""
+    __slots__ = ('messages', 'deadline')
+
+    def __init__(self, message: Message, deadline: float):
+        self.messages: List[Message] = [message]
+        self.deadline = deadline
+
+
+class Debouncer:
+    """
+    :说明:
+
+      连续消息合并，需先通过 ``bind`` 绑定常驻事件循环
+
+    :参数:
+
+      * ``max_messages: int``: 最多合并的消息数，达到后不再并入新的消息
+      * ``separator: str``: 合并文本的分隔符
+    """
+
+    def __init__(self, max_messages: int = 10, separator: str = ' '):
+        self.max_messages = max_messages
+        self.separator = separator
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.slot: Optional[Callable[[Message], AsyncContextManager]] = None
+        self._bursts: Dict[Tuple[Any, Hashable], Burst] = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.merged = 0
+        self.flushed = 0
+
+    def __repr__(self) -> str:
+        return f"<Debouncer bursts={len(self._bursts)}, merged={self.merged}, flushed={self.flushed}>"
+
+    def bind(self, loop: asyncio.AbstractEventLoop, slot: Callable[[Message], AsyncContextManager]) -> None:
+        """绑定常驻事件循环，以及合并结束后运行时获取分发名额的方法"""
+        self.loop = loop
+        self.slot = slot
+
+    def add(self, Matcher: "Matcher", message: Message) -> Optional[Burst]:
+        """
+        :说明:
+
+          加入合并
+
+        :返回:
+
+          - ``Optional[Burst]``: 开始新的合并时返回该合并，需调用 ``wait`` 等待结束；并入已有合并时为 ``None``
+        """
+        key = (Matcher, (message.group, message.user))
+        now = time.monotonic()
+        with self._lock:
+            burst = self._bursts.get(key)
+            if burst is not None and len(burst.messages) < self.max_messages:
+                burst.messages.append(message)
+                burst.deadline = now + Matcher.debounce
+                self.merged += 1
+                return None
+            burst = self._bursts[key] = Burst(message, now + Matcher.debounce)
+            return burst
+
+    async def wait(self, Matcher: "Matcher", burst: Burst) -> Message:
+        """等待合并结束，返回合并后的消息"""
+        key = (Matcher, (burst.messages[0].group, burst.messages[0].user))
+        while True:
+            with self._lock:
+                remaining = burst.deadline - time.monotonic()
+                if remaining <= 0:
+                    if self._bursts.get(key) is burst:
+                        del self._bursts[key]
+                    messages = list(burst.messages)
+                    break
+            await asyncio.sleep(remaining if remaining > 0 else 0)
+        self.flushed += 1
+        return self.combine(messages)
+
+    def combine(self, messages: List[Message]) -> Message:
+        """合并多条消息，其余字段以最后一条为准"""
+        last = messages[-1]
+        if len(messages) == 1:
+            return last
+        msg = self.separator.join(str(message.msg) for message in messages)
+        data = dict(last.data, msg=msg, merged=len(messages)) if isinstance(last.data, dict) else last.data
+        logger.info(f"Merged {len(messages)} messages from {last.user}: {msg}")
+        return Message(data, last.chat_type, last.friend, last.group, last.user, msg, last.wx)
+
+    def spawn(self, coro) -> None:
+        """在常驻事件循环中后台运行"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'bursts': len(self._bursts), 'merged': self.merged, 'flushed': self.flushed}
+
+
+debouncer = Debouncer(DEBOUNCE_MAX_MESSAGES, separator=DEBOUNCE_SEPARATOR)
+"""当前进程的连续消息合并"""
@@ -0,0 +1,240 @@
+"""
+对话存储
+========
+
+``got``、``pause``、``reject`` 暂停的对话按会话 ``(群, 用户)`` 保存，记录事件响应器及其处理函数的指纹、
+下一个处理函数的下标、状态及过期时间，恢复时处理函数已变化的对话被丢弃。对话写入本地 sqlite 数据库，内存中只保留最近使用的部分及已保存对话的会话键，
+其余在需要时从数据库读取，没有暂停对话的会话不访问数据库；
+服务重启后未过期的对话可以继续进行，超过 ``DIALOG_TTL`` 未回复的对话自动结束。
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Set, TYPE_CHECKING
+
+from .config import DIALOG_STORE, DIALOG_CACHE_SIZE, DIALOG_TTL
+from .logger import logger
+
+if TYPE_CHECKING:
+    from classes import Message
+
+
+class Dialog(NamedTuple):
+    """暂停中的对话"""
+    matcher: str
+    """事件响应器 ``Matcher.id``"""
+    cursor: int
+    """继续运行的处理函数下标"""
+    type: str
+    """事件响应器类型"""
+    state: Dict[Any, Any]
+    """对话状态"""
+    expires: float
+    """过期时间戳"""
+    fingerprint: str = ''
+    """事件响应器处理函数的指纹"""
+
+
+def dialog_key(message: "Message") -> str:
+    """对话键，同一个群中的不同用户分别对话"""
+    return f"{message.group or ''}:{message.user}"
+
+
+class DialogStore:
+    """
+    :说明:
+
+      暂停对话存储，可在任意线程调用
+
+    :参数:
+
+      * ``path: Optional[str]``: 数据库文件路径，为空时只保存在内存中
+      * ``capacity: int``: 内存中最多保留的对话数，未持久化时超出的对话被丢弃
+      * ``ttl: float``: 对话有效期（秒）
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 1000, ttl: float = 1800):
+        self.path = path
+        self.capacity = capacity
+        self.ttl = ttl
+        self._cache: "OrderedDict[str, Dialog]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        # 数据库中已保存对话的会话键，不在其中的会话无需查询数据库
+        self._keys: Set[str] = set()
+        self._opened = False
+        self._lock = threading.RLock()
+        self._writes = 0
+        self.hits = 0
+        self.loads = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __repr__(self) -> str:
+        return f"<DialogStore path={self.path}, cached={len(self._cache)}>"
+
+    def open(self) -> None:
+        """打开数据库，清理过期对话并加载最近的对话，重复调用无效"""
+        with self._lock:
+            if self._opened:
+                return
+            self._opened = True
+            if not self.path:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS dialog ("
+                       "key TEXT PRIMARY KEY, matcher TEXT, cursor INTEGER, type TEXT, state BLOB, expires REAL, "
+                       "fingerprint TEXT DEFAULT '')")
+            if 'fingerprint' not in {row[1] for row in db.execute("PRAGMA table_info(dialog)")}:
+                # 旧版本的数据库没有指纹，这些对话恢复时被丢弃
+                db.execute("ALTER TABLE dialog ADD COLUMN fingerprint TEXT DEFAULT ''")
+            self._db = db
+            self.purge()
+            self._keys = {key for key, in db.execute("SELECT key FROM dialog")}
+            rows = db.execute("SELECT key, matcher, cursor, type, state, expires, fingerprint FROM dialog "
+                              "ORDER BY expires DESC LIMIT ?", (self.capacity,)).fetchall()
+            for row in reversed(rows):
+                dialog = self._load(row)
+                if dialog:
+                    self._cache[row[0]] = dialog
+            logger.info(f"dialog store loaded {len(rows)} dialogs")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def _load(self, row) -> Optional[Dialog]:
+        key, matcher, cursor, type_, state, expires, fingerprint = row
+        try:
+            return Dialog(matcher, cursor, type_, pickle.loads(state), expires, fingerprint)
+        except Exception as e:
+            logger.opt(exception=e).warning(f"dialog {key} broken, dropped")
+            self._db.execute("DELETE FROM dialog WHERE key = ?", (key,))
+            self._keys.discard(key)
+            return None
+
+    def put(self, key: str, matcher: str, cursor: int, type_: str, state: Dict[Any, Any],
+            fingerprint: str = '') -> Dialog:
+        """保存一个暂停的对话，覆盖该会话之前的对话"""
+        dialog = Dialog(matcher, cursor, type_, state, time.time() + self.ttl, fingerprint)
+        with self._lock:
+            self.open()
+            self._cache[key] = dialog
+            self._cache.move_to_end(key)
+            persisted = False
+            if self._db:
+                try:
+                    data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+                except Exception as e:
+                    logger.opt(exception=e).warning(f"dialog {key} state can not be persisted, kept in memory")
+                    if key in self._keys:
+                        self._db.execute("DELETE FROM dialog WHERE key = ?", (key,))
+                        self._keys.discard(key)
+                else:
+                    self._db.execute("INSERT OR REPLACE INTO dialog "
+                                     "(key, matcher, cursor, type, state, expires, fingerprint) "
+                                     "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (key, matcher, cursor, type_, data, dialog.expires, fingerprint))
+                    self._keys.add(key)
+                    persisted = True
+                    self._writes += 1
+                    # 定期清理过期对话
+                    if self._writes % 100 == 0:
+                        self.purge()
+            self._evict(None if persisted else key)
+        return dialog
+
+    def _evict(self, keep: Optional[str]) -> None:
+        while len(self._cache) > self.capacity:
+            key = next(iter(self._cache))
+            if key == keep:
+                self._cache.move_to_end(key)
+                key = next(iter(self._cache))
+            del self._cache[key]
+            self.evicted += 1
+            if not self._db:
+                logger.warning(f"dialog {key} evicted, dialog store is full")
+
+    def _get(self, key: str) -> Optional[Dialog]:
+        self.open()
+        dialog = self._cache.get(key)
+        if dialog is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        elif self._db and key in self._keys:
+            row = self._db.execute("SELECT key, matcher, cursor, type, state, expires, fingerprint FROM dialog "
+                                   "WHERE key = ?", (key,)).fetchone()
+            dialog = row and self._load(row)
+            if dialog:
+                self.loads += 1
+                self._cache[key] = dialog
+                self._evict(key)
+        if dialog and dialog.expires < time.time():
+            self._remove(key)
+            self.expired += 1
+            logger.info(f"dialog {key} of {dialog.matcher} expired")
+            return None
+        return dialog
+
+    def _remove(self, key: str) -> None:
+        self._cache.pop(key, None)
+        if self._db and key in self._keys:
+            self._db.execute("DELETE FROM dialog WHERE key = ?", (key,))
+            self._keys.discard(key)
+
+    def pending(self, key: str) -> bool:
+        """会话中是否有暂停的对话"""
+        with self._lock:
+            return self._get(key) is not None
+
+    def pop(self, key: str) -> Optional[Dialog]:
+        """取出会话中暂停的对话"""
+        with self._lock:
+            dialog = self._get(key)
+            if dialog:
+                self._remove(key)
+            return dialog
+
+    def purge(self) -> int:
+        """删除所有过期的对话，返回删除的条数"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, dialog in self._cache.items() if dialog.expires < now]
+            for key in expired:
+                del self._cache[key]
+            count = len(expired)
+            if self._db:
+                keys = [key for key, in self._db.execute("SELECT key FROM dialog WHERE expires < ?", (now,))]
+                self._db.executemany("DELETE FROM dialog WHERE key = ?", ((key,) for key in keys))
+                self._keys.difference_update(keys)
+                count = max(count, len(keys))
+            self.expired += count
+            return count
+
+    def stats(self) -> Dict[str, Any]:
+        """对话存储统计"""
+        with self._lock:
+            stored = len(self._keys) if self._db else len(self._cache)
+            return {
+                'persistent': self._db is not None,
+                'stored': stored,
+                'cached': len(self._cache),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'loads': self.loads,
+                'expired': self.expired,
+                'evicted': self.evicted,
+            }
+
+
+dialogs = DialogStore(DIALOG_STORE, capacity=DIALOG_CACHE_SIZE, ttl=DIALOG_TTL)
+"""当前进程的对话存储"""
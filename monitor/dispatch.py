@@ -0,0 +1,302 @@
+"""
+事件循环分发
+============
+
+单事件循环模式下，微信回调线程只需通过 ``submit`` 将消息放入线程安全的队列，
+在事件循环中处理，不再为每条消息单独创建事件循环。
+
+同时处理的消息数受 ``DISPATCH_CONCURRENCY`` 限制，队列积压时按消息类型丢弃：
+普通消息最先丢弃，其次为私聊及 @ 机器人的消息，命令及进行中的对话只在队列满时丢弃。
+
+消息按会话 ``(群, 用户)`` 分片，同一会话的消息按顺序依次处理，保证 ``got``、``reject`` 等对话流程不会乱序，
+不同会话之间并行处理，分片中的消息处理完毕后立即回收。
+
+各会话待处理的消息按类型进入不同的通道等待空闲的处理名额，名额按 ``DISPATCH_LANE_WEIGHTS`` 加权轮流分配，
+群聊刷屏时命令消息仍能及时处理。
+
+消息入队前先经过限流，被限流的消息只是不分发给事件响应器，消息流及 websocket 推送中仍然保留。
+"""
+import asyncio
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Set, Tuple, TYPE_CHECKING
+
+from .config import BOT_NAME, DISPATCH_CONCURRENCY, DISPATCH_MAX_QUEUE, DISPATCH_SHED_DEPTH, DISPATCH_MAX_WAIT, \
+    DISPATCH_LANE_WEIGHTS
+from .debounce import debouncer
+from .dialog import dialogs, dialog_key
+from .ingress import flood_control
+from .logger import logger
+from .message import handle_event
+from .rule import TrieRule
+
+if TYPE_CHECKING:
+    from classes import Message
+
+COMMAND = 'command'
+MENTION = 'mention'
+PLAIN = 'plain'
+LANES = (COMMAND, MENTION, PLAIN)
+
+
+def classify(message: "Message") -> str:
+    """
+    :说明:
+
+      判断消息类型，用于积压时决定丢弃顺序
+
+    :返回:
+
+      - ``str``: ``command`` 命令或进行中的对话 | ``mention`` 私聊或 @ 机器人 | ``plain`` 普通消息
+    """
+    msg = message.get_message()
+    if not isinstance(msg, str):
+        return PLAIN
+    # 存在暂停中的对话时，新消息是对话的回复
+    if TrieRule.prefix.longest_prefix(msg.lstrip()) or dialogs.pending(dialog_key(message)):
+        return COMMAND
+    if message.chat_type != 'chatroom' or ('@' + BOT_NAME) in msg:
+        return MENTION
+    return PLAIN
+
+
+def flood_admit(message: "Message", lane: str) -> bool:
+    """消息限流，命令及进行中的对话只受发送者限流"""
+    return flood_control.admit(message.group, message.user, message.data, command=lane == COMMAND)
+
+
+def conversation(message: "Message") -> Hashable:
+    """会话分片键 ``(群, 用户)``，私聊时群为 ``None``"""
+    return message.group, message.user
+
+
+class LoopDispatcher:
+    """
+    :说明:
+
+      在单个事件循环中分发消息，``submit`` 可在任意线程调用，``start`` 需在事件循环中调用
+
+    :参数:
+
+      * ``handler: Callable[[Any], Awaitable[Any]]``: 消息处理函数，如 ``handle_event``
+      * ``concurrency: int``: 最多同时处理的消息数
+      * ``max_queue: int``: 队列上限
+      * ``shed_depth: Dict[str, int]``: 各类型消息开始丢弃的队列深度
+      * ``max_wait: float``: 非命令消息最长排队时间（秒）
+      * ``classify: Callable[[Any], str]``: 消息分类函数
+      * ``key: Callable[[Any], Hashable]``: 会话分片键函数，同一键的消息按顺序处理
+      * ``weights: Optional[Dict[str, int]]``: 各类型通道分配处理名额的权重，未设置的类型为 1
+      * ``admit: Optional[Callable[[Any, str], bool]]``: 入队前的限流函数，参数为消息及类型，返回 ``False`` 时丢弃
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[Any], Awaitable[Any]],
+            concurrency: int = 16,
+            max_queue: int = 1000,
+            shed_depth: Optional[Dict[str, int]] = None,
+            max_wait: float = 60,
+            classify: Callable[[Any], str] = classify,
+            key: Callable[[Any], Hashable] = conversation,
+            weights: Optional[Dict[str, int]] = None,
+            admit: Optional[Callable[[Any, str], bool]] = None,
+    ):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.shed_depth = shed_depth or {}
+        self.max_wait = max_wait
+        self.classify = classify
+        self.key = key
+        self.admit = admit
+        self.weights = {lane: max((weights or {}).get(lane, 1), 1) for lane in LANES}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # 空闲的处理名额，以及各通道等待名额的分片
+        self._free = concurrency
+        self._waiting: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        # 平滑加权轮询的当前权重
+        self._current: Dict[str, int] = dict.fromkeys(LANES, 0)
+        # 会话分片，每个分片由一个任务按顺序处理，处理完毕后删除
+        self._shards: Dict[Hashable, Deque[Tuple[str, float, Any]]] = {}
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self.queued = 0
+        self.running = 0
+        self.handled = 0
+        self.max_queued = 0
+        self.lane_handled: Counter = Counter()
+        self.shed: Counter = Counter()
+        """按原因统计的丢弃数，``<类型>_depth`` 积压丢弃，``<类型>_expired`` 排队超时，``queue_full`` 队列已满，``flood`` 被限流"""
+
+    def __repr__(self) -> str:
+        return f"<LoopDispatcher queued={self.queued}, running={self.running}, shards={len(self._shards)}>"
+
+    def start(self) -> None:
+        """绑定当前事件循环"""
+        self.loop = asyncio.get_running_loop()
+        # 事件循环常驻，连续消息合并可在后台进行，合并结束后同样占用处理名额
+        debouncer.bind(self.loop, lambda message: self.slot(self.classify(message)))
+
+    def submit(self, item: Any) -> bool:
+        """
+        :说明:
+
+          放入一条待分发的消息
+
+        :返回:
+
+          - ``bool``: 分发任务未启动时返回 ``False``
+        """
+        if not self.loop or self.loop.is_closed():
+            logger.warning('dispatcher not started, message dropped')
+            return False
+        self.loop.call_soon_threadsafe(self._enqueue, item, time.monotonic())
+        return True
+
+    def _enqueue(self, item: Any, received: float) -> None:
+        try:
+            lane = self.classify(item)
+        except Exception as e:
+            logger.opt(exception=e).error('message classify failed')
+            lane = PLAIN
+        if self.admit and not self.admit(item, lane):
+            self._shed('flood')
+            return
+        depth = self.queued
+        if depth >= self.max_queue:
+            self._shed('queue_full')
+            return
+        if depth >= self.shed_depth.get(lane, self.max_queue):
+            self._shed(f'{lane}_depth')
+            return
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            key = self.key(item)
+        except Exception as e:
+            logger.opt(exception=e).error('message key failed')
+            key = None
+        shard = self._shards.get(key)
+        if shard is None:
+            shard = self._shards[key] = deque()
+            task = self.loop.create_task(self._drain(key, shard))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        shard.append((lane, received, item))
+
+    def _shed(self, reason: str) -> None:
+        self.shed[reason] += 1
+        # 每个原因第一次及每 100 次记录一次日志
+        if self.shed[reason] % 100 == 1:
+            logger.warning(f'dispatch shed {reason} x{self.shed[reason]}, queued={self.queued}')
+
+    async def _acquire(self, lane: str) -> None:
+        """获取一个处理名额，没有空闲名额时在对应通道中等待"""
+        if self._free > 0 and not any(self._waiting.values()):
+            self._free -= 1
+            return
+        future = self.loop.create_future()
+        self._waiting[lane].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 名额已分配但任务被取消，转交给下一个等待者
+                self._release()
+            else:
+                self._waiting[lane].remove(future)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, lane: str):
+        """在分片之外占用一个处理名额，用于后台运行的处理"""
+        await self._acquire(lane)
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.handled += 1
+            self.lane_handled[lane] += 1
+            self._release()
+
+    def _release(self) -> None:
+        """归还处理名额，有等待者时按权重选出通道直接转交"""
+        while True:
+            lane = self._pick()
+            if lane is None:
+                self._free += 1
+                return
+            future = self._waiting[lane].popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+
+    def _pick(self) -> Optional[str]:
+        """平滑加权轮询，选出下一个获得名额的通道"""
+        total, picked = 0, None
+        for lane in LANES:
+            if not self._waiting[lane]:
+                continue
+            weight = self.weights[lane]
+            total += weight
+            self._current[lane] += weight
+            if picked is None or self._current[lane] > self._current[picked]:
+                picked = lane
+        if picked is not None:
+            self._current[picked] -= total
+        return picked
+
+    async def _drain(self, key: Hashable, shard: Deque[Tuple[str, float, Any]]) -> None:
+        """按顺序处理一个会话分片中的消息"""
+        try:
+            while shard:
+                # 按分片中下一条消息的类型排队
+                await self._acquire(shard[0][0])
+                try:
+                    lane, received, item = shard.popleft()
+                    self.queued -= 1
+                    if lane != COMMAND and time.monotonic() - received > self.max_wait:
+                        self._shed(f'{lane}_expired')
+                        continue
+                    self.running += 1
+                    try:
+                        await self.handler(item)
+                    except Exception as e:
+                        logger.opt(exception=e).error('dispatch failed')
+                    finally:
+                        self.running -= 1
+                        self.handled += 1
+                        self.lane_handled[lane] += 1
+                finally:
+                    self._release()
+        finally:
+            # 分片为空时回收，期间没有 await，不会漏掉新放入的消息
+            del self._shards[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """分发统计"""
+        return {
+            'started': self.loop is not None,
+            'concurrency': self.concurrency,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'running': self.running,
+            'shards': len(self._shards),
+            'handled': self.handled,
+            'waiting': {lane: len(waiting) for lane, waiting in self._waiting.items()},
+            'lane_handled': dict(self.lane_handled),
+            'shed': dict(self.shed),
+        }
+
+
+dispatcher = LoopDispatcher(
+    handle_event,
+    concurrency=DISPATCH_CONCURRENCY,
+    max_queue=DISPATCH_MAX_QUEUE,
+    shed_depth=DISPATCH_SHED_DEPTH,
+    max_wait=DISPATCH_MAX_WAIT,
+    weights=DISPATCH_LANE_WEIGHTS,
+    admit=flood_admit,
+)
+"""当前进程的事件分发器"""
@@ -103,6 +103,29 @@ class FinishedException(MonitorException):
     pass
 
 
+class HandlerTimeout(MonitorException):
+    """
+    :说明:
+
+      事件响应器运行超出时限，已被取消。会作为 ``exception`` 参数传递给运行后处理函数。
+
+    :参数:
+
+      * ``matcher``: 超时的事件响应器
+      * ``timeout: float``: 时限（秒）
+    """
+
+    def __init__(self, matcher: Any, timeout: float):
+        self.matcher = matcher
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"<HandlerTimeout matcher={self.matcher}, timeout={self.timeout}>"
+
+    def __str__(self):
+        return self.__repr__()
+
+
 class StopPropagation(MonitorException):
     """
     :说明:
@@ -0,0 +1,297 @@
+"""
+消息入口
+========
+
+收到的聊天消息在构造 ``Message`` 及分发之前先经过入口处理，微信服务及监听服务各自在消息入口调用。
+
+``Deduplicator`` 按消息 id（没有时按时间、发送者及内容）过滤重复投递的消息，
+使用两代轮换的布隆过滤器，内存固定，每条消息至少记住 ``window`` 秒。
+WechatPCAPI 的聊天回调不带消息 id，时间只精确到秒，同一发送者在同一会话的同一秒内发送的相同内容会被视为重复，
+只处理第一条。
+
+``FloodControl`` 按发送者及群分别使用令牌桶限流，超出的消息按策略丢弃、抽样放行或丢弃并计数。
+限流只在事件分发前进行（见 ``monitor.dispatch``），被限流的消息仍写入消息流并推送给监听服务。
+"""
+import hashlib
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .config import DEDUP_WINDOW, DEDUP_CAPACITY, DEDUP_ERROR_RATE, FLOOD_SENDER_RATE, FLOOD_SENDER_BURST, \
+    FLOOD_CHATROOM_RATE, FLOOD_CHATROOM_BURST, FLOOD_POLICY, FLOOD_SAMPLE, FLOOD_MAX_KEYS
+from .logger import logger
+
+DROP = 'drop'
+SAMPLE = 'sample'
+COLLAPSE = 'collapse'
+
+
+def message_key(data: Dict[str, Any]) -> str:
+    """
+    :说明:
+
+      消息去重键，优先使用消息 id，否则使用时间、群、发送者及内容。
+      回调中没有消息 id 时无法区分同一秒内同一发送者发送的相同内容（如连续回复两次 "1"），后一条会被过滤。
+    """
+    msgid = data.get('msgid') or data.get('msg_id')
+    if msgid:
+        return f"id:{msgid}"
+    user = data.get('from_member_wxid', data.get('from_wxid'))
+    return f"{data.get('time')}|{data.get('from_chatroom_wxid')}|{user}|{data.get('msg')}"
+
+
+class Deduplicator:
+    """
+    :说明:
+
+      重复消息过滤，可在任意线程调用
+
+    :参数:
+
+      * ``window: float``: 去重时间窗口（秒）
+      * ``capacity: int``: 单个时间窗口内预计的最多消息数，超出时提前轮换
+      * ``error_rate: float``: 误判为重复的概率上限
+    """
+
+    def __init__(self, window: float = 300, capacity: int = 100000, error_rate: float = 1e-6):
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # 按容量及误判率计算位数及哈希次数
+        self.bits = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.bits / capacity * math.log(2)), 1)
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray((self.bits + 7) // 8)
+        self._count = 0
+        self._rotated = time.monotonic()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.rotations = 0
+        self.early_rotations = 0
+
+    def __repr__(self) -> str:
+        return f"<Deduplicator window={self.window}, checked={self.checked}, duplicates={self.duplicates}>"
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def _rotate(self, now: float) -> None:
+        if now - self._rotated >= 2 * self.window:
+            # 两个窗口内没有消息，全部过期
+            self._previous = bytearray(len(self._current))
+        else:
+            self._previous = self._current
+        self._current = bytearray(len(self._previous))
+        self._count = 0
+        self._rotated = now
+        self.rotations += 1
+
+    def seen(self, key: str) -> bool:
+        """
+        :说明:
+
+          检查消息是否已处理过，未处理过时记录下来
+
+        :返回:
+
+          - ``bool``: 是否为重复消息
+        """
+        positions = self._positions(key)
+        now = time.monotonic()
+        with self._lock:
+            self.checked += 1
+            if now - self._rotated >= self.window:
+                self._rotate(now)
+            current, previous = self._current, self._previous
+            if all(current[p >> 3] & (1 << (p & 7)) for p in positions) or \
+                    all(previous[p >> 3] & (1 << (p & 7)) for p in positions):
+                self.duplicates += 1
+                return True
+            for p in positions:
+                current[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+            if self._count >= self.capacity:
+                self._rotate(now)
+                self.early_rotations += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        """去重统计"""
+        with self._lock:
+            return {
+                'window': self.window,
+                'memory': len(self._current) * 2,
+                'checked': self.checked,
+                'duplicates': self.duplicates,
+                'hit_rate': self.duplicates / self.checked if self.checked else 0.0,
+                'rotations': self.rotations,
+                'early_rotations': self.early_rotations,
+            }
+
+
+class TokenBucket:
+    """令牌桶，同时记录放行及限流的消息数"""
+    __slots__ = ('tokens', 'updated', 'passed', 'limited', 'collapsed')
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+        self.passed = 0
+        self.limited = 0
+        # collapse 策略下尚未报告的被丢弃消息数
+        self.collapsed = 0
+
+    def take(self, rate: float, burst: float, now: float) -> bool:
+        """补充令牌并尝试取出一个"""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class FloodControl:
+    """
+    :说明:
+
+      消息限流，可在任意线程调用。发送者及群各自一个令牌桶，两者均有令牌时放行，命令消息只检查发送者，
+      超出的消息按 ``policy`` 处理:
+
+      * ``drop``: 丢弃
+      * ``sample``: 每 ``sample`` 条放行一条
+      * ``collapse``: 丢弃并计数，被丢弃的消息内容不保留，该发送者下一条放行的消息 ``data['collapsed']`` 为期间丢弃的条数
+
+    :参数:
+
+      * ``sender_rate: float``: 每个发送者每秒补充的令牌数
+      * ``sender_burst: float``: 每个发送者最多积攒的令牌数
+      * ``chatroom_rate: float``: 每个群每秒补充的令牌数
+      * ``chatroom_burst: float``: 每个群最多积攒的令牌数
+      * ``policy: str``: 超出后的处理策略
+      * ``sample: int``: 抽样放行间隔
+      * ``max_keys: int``: 最多保留的令牌桶数，超出时移除最久未使用的
+    """
+
+    def __init__(
+            self,
+            sender_rate: float = 1,
+            sender_burst: float = 5,
+            chatroom_rate: float = 5,
+            chatroom_burst: float = 20,
+            policy: str = DROP,
+            sample: int = 10,
+            max_keys: int = 10000,
+    ):
+        if policy not in (DROP, SAMPLE, COLLAPSE):
+            raise ValueError(f'unknown flood policy {policy}')
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.chatroom_rate = chatroom_rate
+        self.chatroom_burst = chatroom_burst
+        self.policy = policy
+        self.sample = max(sample, 1)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.passed = 0
+        self.limited = 0
+
+    def __repr__(self) -> str:
+        return f"<FloodControl policy={self.policy}, passed={self.passed}, limited={self.limited}>"
+
+    def _bucket(self, key: str, burst: float, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, group: Optional[str], user: Optional[str], data: Dict[str, Any], command: bool = False) -> bool:
+        """
+        :说明:
+
+          判断消息是否放行
+
+        :参数:
+
+          * ``group: Optional[str]``: 群 id，私聊为空
+          * ``user: Optional[str]``: 发送者 wxid
+          * ``data: Dict[str, Any]``: 回调消息数据，collapse 策略下可能写入 ``collapsed``
+          * ``command: bool``: 是否为命令或进行中的对话，为 ``True`` 时不检查群令牌桶，群刷屏时仍可使用命令
+
+        :返回:
+
+          - ``bool``: 是否放行
+        """
+        now = time.monotonic()
+        with self._lock:
+            sender = self._bucket(f'u:{user}', self.sender_burst, now)
+            room = self._bucket(f'r:{group}', self.chatroom_burst, now) if group and not command else None
+            if sender.take(self.sender_rate, self.sender_burst, now):
+                if room is None or room.take(self.chatroom_rate, self.chatroom_burst, now):
+                    return self._pass(sender, room, data)
+                # 群已超出，退还发送者的令牌
+                sender.tokens += 1
+                limited = room
+            else:
+                limited = sender
+
+            limited.limited += 1
+            self.limited += 1
+            if limited.limited % 100 == 1:
+                logger.warning(f'flood limited {user} in {group or "private"} x{limited.limited}, policy={self.policy}')
+            if self.policy == SAMPLE and limited.limited % self.sample == 0:
+                return self._pass(sender, room, data)
+            if self.policy == COLLAPSE:
+                sender.collapsed += 1
+            return False
+
+    def _pass(self, sender: TokenBucket, room: Optional[TokenBucket], data: Dict[str, Any]) -> bool:
+        sender.passed += 1
+        if room is not None:
+            room.passed += 1
+        self.passed += 1
+        if sender.collapsed:
+            data['collapsed'] = sender.collapsed
+            sender.collapsed = 0
+        return True
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        """限流统计，``top`` 为被限流最多的发送者及群"""
+        with self._lock:
+            limited = heapq.nlargest(top, ((bucket.limited, key) for key, bucket in self._buckets.items()
+                                           if bucket.limited))
+            return {
+                'policy': self.policy,
+                'passed': self.passed,
+                'limited': self.limited,
+                'buckets': len(self._buckets),
+                'top': {key: count for count, key in limited},
+            }
+
+
+deduplicator = Deduplicator(DEDUP_WINDOW, capacity=DEDUP_CAPACITY, error_rate=DEDUP_ERROR_RATE)
+"""当前进程的重复消息过滤"""
+
+flood_control = FloodControl(
+    FLOOD_SENDER_RATE,
+    FLOOD_SENDER_BURST,
+    FLOOD_CHATROOM_RATE,
+    FLOOD_CHATROOM_BURST,
+    policy=FLOOD_POLICY,
+    sample=FLOOD_SAMPLE,
+    max_keys=FLOOD_MAX_KEYS,
+)
+"""当前进程的消息限流"""
@@ -0,0 +1,156 @@
+"""
+微信登录状态
+============
+
+微信服务启动后依次经过 ``starting`` -> ``logged_in`` -> ``contacts_synced`` -> ``ready`` 四个阶段，
+状态变化由微信回调驱动。登录后通讯录未能及时同步时先进入 ``degraded``，此时只有上次的通讯录快照可用，
+同步完毕后再继续进入 ``contacts_synced`` 及 ``ready``。监听服务通过 websocket 接收状态推送，插件中可以等待微信就绪后再执行。
+
+用法:
+
+.. code-block:: python
+
+    from monitor.lifecycle import lifecycle, READY
+
+    @matcher.handle()
+    async def _(message):
+        if not await lifecycle.wait_for(READY, timeout=10):
+            return
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .logger import logger
+
+LIFECYCLE_EVENT = 'lifecycle'
+"""状态推送消息的 ``event`` 字段"""
+
+STARTING = 'starting'
+LOGGED_IN = 'logged_in'
+DEGRADED = 'degraded'
+CONTACTS_SYNCED = 'contacts_synced'
+READY = 'ready'
+STATES = (STARTING, LOGGED_IN, DEGRADED, CONTACTS_SYNCED, READY)
+"""按先后顺序排列的全部状态"""
+
+
+class Lifecycle:
+    """
+    :说明:
+
+      微信登录状态，``set`` 及 ``wait`` 可在任意线程调用，``wait_for`` 需在事件循环中调用
+    """
+
+    def __init__(self):
+        self.state: Optional[str] = None
+        self.changed: Dict[str, float] = {}
+        self._listeners: List[Callable[[Dict[str, Any]], Any]] = []
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._cond = threading.Condition()
+
+    def __repr__(self) -> str:
+        return f"<Lifecycle state={self.state}>"
+
+    def reached(self, state: str) -> bool:
+        """是否已到达指定状态"""
+        return self.state is not None and STATES.index(self.state) >= STATES.index(state)
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], Any]) -> None:
+        """订阅状态变化，回调参数同 ``snapshot``"""
+        self._listeners.append(callback)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'event': LIFECYCLE_EVENT, 'state': self.state, 'changed': dict(self.changed)}
+
+    def set(self, state: Optional[str]) -> None:
+        """
+        :说明:
+
+          切换状态，``starting`` 及 ``None`` 会清空之前的状态时间，用于微信重启或连接断开
+
+        :参数:
+
+          * ``state: Optional[str]``: ``STATES`` 之一，为 ``None`` 时表示状态未知
+        """
+        self._update(state)
+
+    def apply(self, frame: Dict[str, Any]) -> None:
+        """应用微信服务推送的状态"""
+        self._update(frame.get('state'), frame.get('changed') or {})
+
+    def _update(self, state: Optional[str], changed: Optional[Dict[str, float]] = None) -> None:
+        if state is not None and state not in STATES:
+            raise ValueError(f'unknown state {state}')
+        with self._cond:
+            if changed is not None:
+                self.changed = dict(changed)
+            elif state == self.state:
+                return
+            else:
+                if state in (None, STARTING):
+                    self.changed = {}
+                if state is not None:
+                    self.changed[state] = time.time()
+            self.state = state
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+        logger.info(f'wechat lifecycle {state}')
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        frame = self.snapshot()
+        for listener in self._listeners:
+            try:
+                listener(frame)
+            except Exception as e:
+                logger.opt(exception=e).error(f'lifecycle listener {listener} failed')
+
+    def wait(self, state: str, timeout: Optional[float] = None) -> bool:
+        """
+        :说明:
+
+          阻塞等待到达指定状态
+
+        :返回:
+
+          - ``bool``: 超时前是否到达
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.reached(state), timeout)
+
+    async def wait_for(self, state: str, timeout: Optional[float] = None) -> bool:
+        """
+        :说明:
+
+          在事件循环中等待到达指定状态
+
+        :返回:
+
+          - ``bool``: 超时前是否到达
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            future = loop.create_future()
+            with self._cond:
+                if self.reached(state):
+                    return True
+                self._waiters.append((loop, future))
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                with self._cond:
+                    if (loop, future) in self._waiters:
+                        self._waiters.remove((loop, future))
+                return self.reached(state)
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+lifecycle = Lifecycle()
+"""当前进程的微信登录状态"""
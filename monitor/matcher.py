@@ -1,5 +1,6 @@
+import hashlib
 import inspect
-from collections import defaultdict
+from collections import Counter, defaultdict
 from contextvars import ContextVar
 from functools import wraps
 from typing import Type, List, Dict, Union, Callable, Optional, TYPE_CHECKING, NoReturn
@@ -7,7 +8,9 @@ from typing import Type, List, Dict, Union, Callable, Optional, TYPE_CHECKING, N
 from monitor.exception import StopPropagation, FinishedException, PausedException, RejectedException
 from monitor.logger import logger
 from classes import Message
+from .dialog import Dialog, dialogs, dialog_key
 from .rule import Rule
+from .state import State
 from .typing import T_Handler, T_State, T_StateFactory, T_ArgsParser, T_TypeUpdater
 
 if TYPE_CHECKING:
@@ -19,6 +22,8 @@ matchers: Dict[int, List[Type["Matcher"]]] = defaultdict(list)
 :说明: 用于存储当前所有的事件响应器
 """
 current_message: ContextVar = ContextVar("current_message")
+_registered: Dict[str, Type["Matcher"]] = {}
+_module_counts: Counter = Counter()
 
 
 class MatcherMeta(type):
@@ -39,6 +44,11 @@ class Matcher(metaclass=MatcherMeta):
     :类型: ``Optional[str]``
     :说明: 事件响应器所在模块名称
     """
+    id: Optional[str] = None
+    """
+    :类型: ``Optional[str]``
+    :说明: 事件响应器标识，由模块名称及在模块中的创建顺序组成，用于恢复暂停的对话，临时事件响应器为 ``None``
+    """
 
     type: str = ""
     """
@@ -70,6 +80,33 @@ class Matcher(metaclass=MatcherMeta):
     :类型: ``bool``
     :说明: 事件响应器是否为临时
     """
+    timeout: Optional[float] = None
+    """
+    :类型: ``Optional[float]``
+    :说明: 事件响应器运行时限（秒），超时后取消运行，为 ``None`` 时使用全局配置 ``HANDLER_TIMEOUT``
+    """
+    fallback: Optional[str] = None
+    """
+    :类型: ``Optional[str]``
+    :说明: 运行超时后的回复消息，为 ``None`` 时使用全局配置 ``HANDLER_FALLBACK``
+    """
+    debounce: Optional[float] = None
+    """
+    :类型: ``Optional[float]``
+    :说明: 合并同一会话连续消息的静默时间（秒），为 ``None`` 时不合并
+    """
+
+    stateless: bool = False
+    """
+    :类型: ``bool``
+    :说明: 是否为无状态事件响应器，即没有默认状态、``got``、``receive`` 及接收 ``matcher`` 参数的处理函数，
+      此类事件响应器运行时不实例化，处理函数中的 ``state`` 为当前事件的状态
+    """
+    _context: Optional["Matcher"] = None
+    """
+    :类型: ``Optional[Matcher]``
+    :说明: 无状态事件响应器共享的实例，运行时不会修改
+    """
 
     _default_state: T_State = {}
     """
@@ -94,9 +131,11 @@ class Matcher(metaclass=MatcherMeta):
     """
 
     def __init__(self):
-        """实例化 Matcher 以便运行"""
-        self.handlers = self.handlers.copy()
-        self.state = self._default_state.copy()
+        """实例化 Matcher 以便运行，状态叠加在默认状态之上，处理函数按下标依次运行，均不复制"""
+        self.cursor = 0
+        self.state = State(self._default_state)
+        # 是否为恢复的对话
+        self.restored = False
 
     def __repr__(self) -> str:
         return (f"<Matcher from {self.module or 'unknown'}, type={self.type}, "
@@ -114,6 +153,9 @@ class Matcher(metaclass=MatcherMeta):
             priority: int = 1,
             block: bool = False,
             *,
+            timeout: Optional[float] = None,
+            fallback: Optional[str] = None,
+            debounce: Optional[float] = None,
             module: Optional[str] = None,
             default_state: Optional[T_State] = None,
             default_state_factory: Optional[T_StateFactory] = None,
@@ -131,6 +173,9 @@ class Matcher(metaclass=MatcherMeta):
           * ``temp: bool``: 是否为临时事件响应器，即触发一次后删除
           * ``priority: int``: 响应优先级
           * ``block: bool``: 是否阻止事件向更低优先级的响应器传播
+          * ``timeout: Optional[float]``: 运行时限（秒）
+          * ``fallback: Optional[str]``: 运行超时后的回复消息
+          * ``debounce: Optional[float]``: 合并同一会话连续消息的静默时间（秒）
           * ``module: Optional[str]``: 事件响应器所在模块名称
           * ``default_state: Optional[T_State]``: 默认状态 ``state``
           * ``default_state_factory: Optional[T_StateFactory]``: 默认状态 ``state`` 的工厂函数
@@ -157,17 +202,68 @@ class Matcher(metaclass=MatcherMeta):
                     priority,
                 "block":
                     block,
+                "timeout":
+                    timeout,
+                "fallback":
+                    fallback,
+                "debounce":
+                    debounce,
                 "_default_state":
                     default_state or {},
                 "_default_state_factory":
                     staticmethod(default_state_factory)
                     if default_state_factory else None
             })
+        NewMatcher._update_stateless()
+        if not temp:
+            NewMatcher.id = f"{module}:{_module_counts[module]}"
+            _module_counts[module] += 1
+            _registered[NewMatcher.id] = NewMatcher
 
         matchers[priority].append(NewMatcher)
 
         return NewMatcher
 
+    @staticmethod
+    def restore(dialog: Dialog) -> Optional["Matcher"]:
+        """
+        :说明:
+
+          恢复暂停的对话，返回从暂停处继续运行的事件响应器实例
+
+        :返回:
+
+          - ``Optional[Matcher]``: 事件响应器已不存在时为 ``None``
+        """
+        Origin = _registered.get(dialog.matcher)
+        # 标识按创建顺序生成，插件变化后同一标识可能对应其他事件响应器
+        if Origin is None or dialog.cursor > len(Origin.handlers) or dialog.fingerprint != Origin.fingerprint():
+            logger.warning(f"Matcher {dialog.matcher} of dialog not found or changed, dropped")
+            return None
+        matcher = Origin()
+        matcher.cursor = dialog.cursor
+        matcher.type = dialog.type
+        matcher.state = State(dialog.state)
+        matcher.restored = True
+        matcher.block = True
+        return matcher
+
+    @classmethod
+    def fingerprint(cls) -> str:
+        """处理函数的指纹，用于判断恢复的对话是否仍属于该事件响应器"""
+        names = "|".join(f"{handler.__module__}.{getattr(handler, '__qualname__', type(handler).__name__)}"
+                         for handler in cls.handlers)
+        return hashlib.blake2b(names.encode("utf-8"), digest_size=8).hexdigest()
+
+    @classmethod
+    def _update_stateless(cls) -> None:
+        """处理函数变化后重新判断是否为无状态事件响应器"""
+        cls.stateless = not (cls.temp or cls._default_state or cls._default_state_factory) and all(
+            handler.__params__["matcher"] is None and not getattr(handler, "__pauses__", False)
+            for handler in cls.handlers)
+        if cls.stateless and "_context" not in cls.__dict__:
+            cls._context = cls()
+
     @classmethod
     async def check_rule(cls, message: "Message", state: T_State) -> bool:
         """
@@ -227,12 +323,64 @@ class Matcher(metaclass=MatcherMeta):
             "state": T_State if state else None,
             "matcher": matcher.annotation if matcher else None
         }
+        Matcher.compile_handler(handler)
         return handler
 
+    @staticmethod
+    def compile_handler(handler: T_Handler) -> T_Handler:
+        """
+        :说明:
+
+          根据 ``__params__`` 生成固定参数的调用函数 ``__call_adapter__(matcher, message, state)``，
+          消息类型检查及参数筛选只在此处进行一次，``__params__`` 变化后需重新调用
+
+        :参数:
+
+          * ``handler: T_Handler``: 已经过 ``process_handler`` 处理的事件处理函数
+        """
+        params = handler.__params__
+        MessageType = ((params["message"] is not inspect.Parameter.empty) and
+                       inspect.isclass(params["message"]) and params["message"])
+        with_state = params["state"] is not None
+        with_matcher = params["matcher"] is not None
+
+        if with_state and with_matcher:
+            def call(matcher, message, state):
+                return handler(message=message, state=state, matcher=matcher)
+        elif with_state:
+            def call(matcher, message, state):
+                return handler(message=message, state=state)
+        elif with_matcher:
+            def call(matcher, message, state):
+                return handler(message=message, matcher=matcher)
+        else:
+            def call(matcher, message, state):
+                return handler(message=message)
+
+        if MessageType:
+            direct = call
+
+            async def call(matcher, message, state):
+                if not isinstance(message, MessageType):
+                    logger.debug(
+                        f"Matcher {matcher} message type {type(message)} not match annotation {MessageType}, ignored"
+                    )
+                    return
+                await direct(matcher, message, state)
+
+        handler.__call_adapter__ = call
+        return handler
+
+    @staticmethod
+    def _update_message_type(handler: T_Handler, message_type) -> None:
+        handler.__params__["message"] = message_type
+        Matcher.compile_handler(handler)
+
     @classmethod
     def append_handler(cls, handler: T_Handler) -> None:
         # Process handler first
         cls.handlers.append(cls.process_handler(handler))
+        cls._update_stateless()
 
     @classmethod
     def handle(cls) -> Callable[[T_Handler], T_Handler]:
@@ -267,6 +415,7 @@ class Matcher(metaclass=MatcherMeta):
         async def _receive(message: "Message") -> NoReturn:
             raise PausedException
 
+        _receive.__pauses__ = True
         cls.process_handler(_receive)
 
         if cls.handlers:
@@ -278,10 +427,7 @@ class Matcher(metaclass=MatcherMeta):
             if not cls.handlers or cls.handlers[-1] is not func:
                 cls.append_handler(func)
 
-            _receive.__params__.update({
-                "message":
-                    func.__params__["message"],
-            })
+            cls._update_message_type(_receive, func.__params__["message"])
 
             return func
 
@@ -333,6 +479,7 @@ class Matcher(metaclass=MatcherMeta):
             else:
                 state[state["_current_key"]] = str(message.get_message())
 
+        _key_getter.__pauses__ = True
         cls.append_handler(_key_getter)
         cls.append_handler(_key_parser)
 
@@ -344,25 +491,15 @@ class Matcher(metaclass=MatcherMeta):
                 @wraps(func)
                 async def wrapper(message: "Message", state: T_State,
                                   matcher: Matcher):
-                    await matcher.run_handler(parser, message, state)
-                    await matcher.run_handler(func, message, state)
+                    await parser.__call_adapter__(matcher, message, state)
+                    await func.__call_adapter__(matcher, message, state)
                     if "_current_key" in state:
                         del state["_current_key"]
 
                 cls.append_handler(wrapper)
 
-                wrapper.__params__.update({
-                    "message":
-                        func.__params__["message"],
-                })
-                _key_getter.__params__.update({
-                    "message":
-                        func.__params__["message"],
-                })
-                _key_parser.__params__.update({
-                    "message":
-                        func.__params__["message"],
-                })
+                for handler in (wrapper, _key_getter, _key_parser):
+                    cls._update_message_type(handler, func.__params__["message"])
 
             return func
 
@@ -458,65 +595,34 @@ class Matcher(metaclass=MatcherMeta):
         self.block = True
 
     async def run_handler(self, handler: T_Handler, message: "Message", state: T_State):
-        if not hasattr(handler, "__params__"):
+        if not hasattr(handler, "__call_adapter__"):
             self.process_handler(handler)
-        params = getattr(handler, "__params__")
-
-        MessageType = ((params["message"] is not inspect.Parameter.empty) and
-                       inspect.isclass(params["message"]) and params["message"])
-
-        if MessageType and not isinstance(message, MessageType):
-            logger.debug(
-                f"Matcher {self} message type {type(message)} not match annotation {MessageType}, ignored"
-            )
-            return
-
-        args = {"message": message, "state": state, "matcher": self}
-        await handler(
-            **{k: v for k, v in args.items() if params[k] is not None})
+        await handler.__call_adapter__(self, message, state)
 
     # 运行handlers
     async def run(self, message: "Message", state: T_State):
         m_g = current_message.set(message)
+        handlers = self.handlers
         try:
             # Refresh preprocess state
-            state_ = await self._default_state_factory(message) \
-                if self._default_state_factory else self.state
+            if self._default_state_factory:
+                state_ = await self._default_state_factory(message)
+                if self.restored:
+                    # 恢复的对话状态叠加在默认状态之上
+                    state_ = State(state_)
+                    state_.update(self.state)
+            else:
+                state_ = self.state
             state_.update(state)
 
-            for _ in range(len(self.handlers)):
-                handler = self.handlers.pop(0)
-                await self.run_handler(handler, message, state_)
+            for self.cursor in range(self.cursor, len(handlers)):
+                await self.run_handler(handlers[self.cursor], message, state_)
+            self.cursor = len(handlers)
 
         except RejectedException:
-            self.handlers.insert(0, handler)  # type: ignore
-            if self._default_type_updater:
-                type_ = await self._default_type_updater(
-                    message, state, self.type)
-            else:
-                type_ = "message"
-            Matcher.new(type_,
-                        Rule(),
-                        self.handlers,
-                        temp=True,
-                        priority=0,
-                        block=True,
-                        module=self.module,
-                        default_state=self.state)
+            await self._resume(message, state, self.cursor, state_)
         except PausedException:
-            if self._default_type_updater:
-                type_ = await self._default_type_updater(
-                    message, state, self.type)
-            else:
-                type_ = "message"
-            Matcher.new(type_,
-                        Rule(),
-                        self.handlers,
-                        temp=True,
-                        priority=0,
-                        block=True,
-                        module=self.module,
-                        default_state=self.state)
+            await self._resume(message, state, self.cursor + 1, state_)
         except FinishedException:
             pass
 
@@ -526,3 +632,62 @@ class Matcher(metaclass=MatcherMeta):
         finally:
             logger.info(f"Matcher {self} running complete")
             current_message.reset(m_g)
+
+    @classmethod
+    async def run_stateless(cls, message: "Message", state: T_State) -> bool:
+        """
+        :说明:
+
+          使用共享实例运行无状态事件响应器，不复制处理函数，状态叠加在事件状态之上，写入不影响其他事件响应器
+
+        :返回:
+
+          - ``bool``: 是否阻止事件传播
+        """
+        matcher = cls._context
+        handlers = cls.handlers
+        state = State(state)
+        m_g = current_message.set(message)
+        index = 0
+        try:
+            for index in range(len(handlers)):
+                await handlers[index].__call_adapter__(matcher, message, state)
+
+        # 处理函数仍可通过 pause、reject 进入对话
+        except RejectedException:
+            await matcher._resume(message, state, index, state)
+        except PausedException:
+            await matcher._resume(message, state, index + 1, state)
+        except FinishedException:
+            pass
+
+        except StopPropagation:
+            return True
+
+        finally:
+            logger.info(f"Matcher {matcher} running complete")
+            current_message.reset(m_g)
+        return cls.block
+
+    async def _resume(self, message: "Message", state: T_State, cursor: int, dialog_state: T_State) -> None:
+        """暂停对话，在接收该会话新的一条消息后从下标 ``cursor`` 处继续运行处理函数"""
+        if self._default_type_updater:
+            type_ = await self._default_type_updater(
+                message, state, self.type)
+        else:
+            type_ = "message"
+        dialog_state = dialog_state.flatten() if isinstance(dialog_state, State) else dict(dialog_state)
+        if self.id:
+            dialogs.put(dialog_key(message), self.id, cursor, type_, dialog_state, self.fingerprint())
+            return
+        # 没有标识的临时事件响应器无法恢复，仍创建临时事件响应器
+        Matcher.new(type_,
+                    Rule(),
+                    self.handlers[cursor:],
+                    temp=True,
+                    priority=0,
+                    block=True,
+                    timeout=self.timeout,
+                    fallback=self.fallback,
+                    module=self.module,
+                    default_state=dialog_state)
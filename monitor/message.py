@@ -6,9 +6,12 @@ Monitor 内部处理并按优先级分发事件给所有事件响应器，提供
 """
 
 import asyncio
-from typing import Set, Type, TYPE_CHECKING
+from typing import Any, Awaitable, Callable, Optional, Set, Type, TYPE_CHECKING
 
-from .exception import IgnoredException, StopPropagation
+from .config import HANDLER_TIMEOUT, HANDLER_FALLBACK
+from .debounce import debouncer, Burst
+from .dialog import dialogs, dialog_key
+from .exception import IgnoredException, StopPropagation, HandlerTimeout
 from .logger import logger
 from .matcher import matchers, Matcher
 from .rule import TrieRule
@@ -89,7 +92,7 @@ def run_postprocessor(func: T_RunPostProcessor) -> T_RunPostProcessor:
       运行后处理函数接收五个参数。
 
       * ``matcher: Matcher``: 运行完毕的事件响应器
-      * ``exception: Optional[Exception]``: 事件响应器运行错误（如果存在）
+      * ``exception: Optional[Exception]``: 事件响应器运行错误（如果存在），运行超时时为 ``HandlerTimeout``
       * ``bot: Bot``: Bot 对象
       * ``event: Event``: Event 对象
       * ``state: T_State``: 当前 State
@@ -98,13 +101,22 @@ def run_postprocessor(func: T_RunPostProcessor) -> T_RunPostProcessor:
     return func
 
 
-async def _check_matcher(priority: int, Matcher: Type[Matcher], message: "Message", state: T_State) -> None:
+async def _check_rule(Matcher: Type[Matcher], message: "Message", state: T_State) -> Optional[T_State]:
+    """在 state 副本上检查规则，规则写入的内容不会影响其他事件响应器，匹配时返回该副本"""
+    rule_state = state.copy()
     try:
-        if not await Matcher.check_rule(message, state):
-            return
+        if await Matcher.check_rule(message, rule_state):
+            return rule_state
     except Exception as e:
         logger.opt(colors=True, exception=e).error(
             f"<r><bg #f8bbd0>Rule check failed for {Matcher}.</bg #f8bbd0></r>")
+    return None
+
+
+async def _check_matcher(priority: int, Matcher: Type[Matcher], checked: "asyncio.Future[Optional[T_State]]",
+                         message: "Message", state: T_State) -> None:
+    rule_state = await checked
+    if rule_state is None:
         return
 
     if Matcher.temp:
@@ -113,17 +125,58 @@ async def _check_matcher(priority: int, Matcher: Type[Matcher], message: "Messag
         except Exception:
             pass
 
+    # 只在常驻事件循环中合并，每条消息单独创建事件循环时直接运行
+    if Matcher.debounce and asyncio.get_running_loop() is debouncer.loop:
+        await _debounce(Matcher, message, state, rule_state)
+        return
+
+    state.update(rule_state)
     await _run_matcher(Matcher, message, state)
 
 
-async def _run_matcher(Matcher: Type[Matcher], message: "Message", state: T_State) -> None:
-    logger.info(f"Event will be handled by {Matcher}")
+async def _debounce(Matcher: Type[Matcher], message: "Message", state: T_State, rule_state: T_State) -> None:
+    """合并同一会话的连续消息，第一条消息在后台等待合并结束后运行事件响应器"""
+    burst = debouncer.add(Matcher, message)
+    if burst is not None:
+        debouncer.spawn(_run_burst(Matcher, burst, dict(state, **rule_state)))
+    if Matcher.block:
+        raise StopPropagation
 
-    matcher = Matcher()
 
-    coros = list(
-        map(lambda x: x(matcher, message, state), _run_preprocessors))
-    if coros:
+async def _run_burst(Matcher: Type[Matcher], burst: Burst, state: T_State) -> None:
+    message = await debouncer.wait(Matcher, burst)
+    if message is not burst.messages[0]:
+        # 使用合并后的文本重新匹配，刷新 _prefix、_matched 等状态
+        merged_state = {}
+        TrieRule.get_value(message, merged_state)
+        rule_state = await _check_rule(Matcher, message, merged_state)
+        if rule_state is not None:
+            state = rule_state
+    # 后台运行不在分发的会话分片中，需另外占用处理名额
+    async with debouncer.slot(message):
+        try:
+            await _run_matcher(Matcher, message, state)
+        except StopPropagation:
+            pass
+
+
+async def _run_matcher(Matcher: Type[Matcher], message: "Message", state: T_State,
+                       matcher: Optional[Matcher] = None) -> None:
+    logger.info(f"Event will be handled by {Matcher}")
+
+    if matcher is not None:
+        # 恢复的对话
+        run = matcher.run
+    elif Matcher.stateless and not _run_preprocessors and not _run_postprocessors:
+        # 无状态的事件响应器不实例化，使用共享实例运行
+        matcher = Matcher._context
+        run = Matcher.run_stateless
+    else:
+        matcher = Matcher()
+        run = matcher.run
+
+    if _run_preprocessors:
+        coros = [x(matcher, message, state) for x in _run_preprocessors]
         try:
             await asyncio.gather(*coros)
         except IgnoredException:
@@ -137,20 +190,24 @@ async def _run_matcher(Matcher: Type[Matcher], message: "Message", state: T_Stat
             return
 
     exception = None
+    block = False
 
     try:
         logger.debug(f"Running matcher {matcher}")
-        await matcher.run(message, state)
+        block = await _run_with_timeout(matcher, run, message, state)
+    except HandlerTimeout as e:
+        logger.opt(colors=True).warning(
+            f"<y>Running matcher {matcher} timed out after {e.timeout}s, cancelled</y>")
+        exception = e
+        _send_fallback(matcher, message)
     except Exception as e:
         logger.opt(colors=True, exception=e).error(
             f"<r><bg #f8bbd0>Running matcher {matcher} failed.</bg #f8bbd0></r>"
         )
         exception = e
 
-    coros = list(
-        map(lambda x: x(matcher, exception, message, state),
-            _run_postprocessors))
-    if coros:
+    if _run_postprocessors:
+        coros = [x(matcher, exception, message, state) for x in _run_postprocessors]
         try:
             await asyncio.gather(*coros)
         except Exception as e:
@@ -158,11 +215,53 @@ async def _run_matcher(Matcher: Type[Matcher], message: "Message", state: T_Stat
                 "<r><bg #f8bbd0>Error when running RunPostProcessors</bg #f8bbd0></r>"
             )
 
-    if matcher.block:
+    if block or matcher.block:
         raise StopPropagation
     return
 
 
+async def _run_with_timeout(matcher: Matcher, run: Callable[["Message", T_State], Awaitable[Any]],
+                            message: "Message", state: T_State) -> Any:
+    """运行事件响应器，超出时限时取消运行并抛出 ``HandlerTimeout``"""
+    timeout = matcher.timeout if matcher.timeout is not None else HANDLER_TIMEOUT
+    if not timeout:
+        return await run(message, state)
+
+    # 在当前任务中运行，到时由定时回调取消当前任务，不为每次运行创建新任务；
+    # 只有定时回调造成的取消才视为超时，处理函数内部抛出的 TimeoutError 及外部取消照常传递
+    task = asyncio.current_task()
+    expired = False
+
+    def expire():
+        nonlocal expired
+        expired = True
+        task.cancel()
+
+    handle = asyncio.get_running_loop().call_later(timeout, expire)
+    try:
+        return await run(message, state)
+    except asyncio.CancelledError:
+        if not expired:
+            raise
+        # 撤销本次取消请求，避免影响外层的取消计数
+        if hasattr(task, "uncancel"):
+            task.uncancel()
+        raise HandlerTimeout(matcher, timeout) from None
+    finally:
+        handle.cancel()
+
+
+def _send_fallback(matcher: Matcher, message: "Message") -> None:
+    fallback = matcher.fallback if matcher.fallback is not None else HANDLER_FALLBACK
+    friend = message.group or message.user
+    if not fallback or not friend or not message.wx:
+        return
+    try:
+        message.wx.send_text(friend, fallback)
+    except Exception as e:
+        logger.opt(exception=e).error(f"Sending fallback reply of {matcher} failed")
+
+
 async def handle_event(message: "Message"):
     """
     处理一个事件。调用该函数以实现分发事件。
@@ -193,22 +292,43 @@ async def handle_event(message: "Message"):
 
     break_flag = False
 
-    for priority in sorted(matchers.keys()):
-
-        if break_flag:
-            break
-
-        pending_tasks = [
-            _check_matcher(priority, matcher, message, state)
-            for matcher in matchers[priority]
-        ]
-        results = await asyncio.gather(*pending_tasks, return_exceptions=True)
-
-        for result in results:
-            if isinstance(result, StopPropagation):
-                if not break_flag:
-                    break_flag = True
-                    logger.debug("Stop event propagation")
+    # 会话中有暂停的对话时先继续对话，对话会阻止事件传播
+    dialog = dialogs.pop(dialog_key(message))
+    matcher = dialog and Matcher.restore(dialog)
+    if matcher:
+        try:
+            await _run_matcher(type(matcher), message, state, matcher)
+        except StopPropagation:
+            break_flag = True
+
+    # 预先并发检查所有优先级的规则，低优先级的规则检查与高优先级的处理函数同时进行，
+    # 处理函数仍按优先级顺序运行，被阻断的优先级直接取消检查
+    checks = {
+        priority: [(matcher, asyncio.ensure_future(_check_rule(matcher, message, state)))
+                   for matcher in matchers[priority]]
+        for priority in sorted(matchers.keys())
+    } if not break_flag else {}
+    try:
+        for priority, checked in checks.items():
+
+            if break_flag:
+                break
+
+            pending_tasks = [
+                _check_matcher(priority, matcher, check, message, state)
+                for matcher, check in checked
+            ]
+            results = await asyncio.gather(*pending_tasks, return_exceptions=True)
+
+            for result in results:
+                if isinstance(result, StopPropagation):
+                    if not break_flag:
+                        break_flag = True
+                        logger.debug("Stop event propagation")
+    finally:
+        for checked in checks.values():
+            for _, check in checked:
+                check.cancel()
 
     coros = list(map(lambda x: x(message, state), _event_postprocessors))
     if coros:
@@ -54,6 +54,9 @@ def on(
         block: bool = False,
         state: Optional[T_State] = None,
         state_factory: Optional[T_StateFactory] = None,
+        timeout: Optional[float] = None,
+        fallback: Optional[str] = None,
+        debounce: Optional[float] = None,
         _depth: int = 0,
 ) -> Type[Matcher]:
     """
@@ -67,6 +70,9 @@ def on(
         block: 是否阻止事件向更低优先级传递
         state: 默认 state
         state_factory: 默认 state 的工厂函数
+        timeout: 运行时限（秒），不填时使用全局配置 HANDLER_TIMEOUT
+        fallback: 运行超时后的回复消息，不填时使用全局配置 HANDLER_FALLBACK
+        debounce: 合并同一会话连续消息的静默时间（秒），不填时不合并，只在常驻事件循环中生效
     返回:
         Type[Matcher]
     """
@@ -79,6 +85,9 @@ def on(
         handlers=handlers,
         default_state=state,
         default_state_factory=state_factory,
+        timeout=timeout,
+        fallback=fallback,
+        debounce=debounce,
         module=_get_matcher_module(_depth + 1),
     )
     _store_matcher(matcher)
@@ -94,6 +103,9 @@ def on_message(
         block: bool = True,
         state: Optional[T_State] = None,
         state_factory: Optional[T_StateFactory] = None,
+        timeout: Optional[float] = None,
+        fallback: Optional[str] = None,
+        debounce: Optional[float] = None,
         _depth: int = 0,
 ) -> Type[Matcher]:
     """
@@ -106,6 +118,9 @@ def on_message(
         block: 是否阻止事件向更低优先级传递
         state: 默认 state
         state_factory: 默认 state 的工厂函数
+        timeout: 运行时限（秒），不填时使用全局配置 HANDLER_TIMEOUT
+        fallback: 运行超时后的回复消息，不填时使用全局配置 HANDLER_FALLBACK
+        debounce: 合并同一会话连续消息的静默时间（秒），不填时不合并，只在常驻事件循环中生效
     返回:
         Type[Matcher]
     """
@@ -118,6 +133,9 @@ def on_message(
         handlers=handlers,
         default_state=state,
         default_state_factory=state_factory,
+        timeout=timeout,
+        fallback=fallback,
+        debounce=debounce,
         module=_get_matcher_module(_depth + 1),
     )
     _store_matcher(matcher)
@@ -0,0 +1,93 @@
+"""
+分层状态
+========
+
+事件响应器运行时的 ``state`` 由本次写入的内容叠加在默认状态之上，读取时逐层查找，
+写入及删除只作用于最上层，默认状态不会被复制或修改。
+暂停对话时当前状态直接作为临时事件响应器的默认状态，后续消息无需再复制整个状态。
+"""
+from typing import Any, Dict, Iterator, Mapping, MutableMapping, Optional, Set
+
+
+class State(MutableMapping):
+    """
+    :说明:
+
+      写时复制的分层状态
+
+    :参数:
+
+      * ``base: Optional[Mapping]``: 默认状态，只读
+    """
+
+    __slots__ = ("base", "depth", "_data", "_deleted")
+
+    MAX_DEPTH = 8
+    """层数超出时合并为一层，避免多轮对话后查找过慢"""
+
+    def __init__(self, base: Optional[Mapping] = None):
+        depth = base.depth + 1 if isinstance(base, State) else 1
+        if depth > self.MAX_DEPTH:
+            base, depth = base.flatten(), 1
+        self.base: Mapping = base if base is not None else {}
+        self.depth = depth
+        self._data: Dict[Any, Any] = {}
+        # 已删除的默认状态中的键
+        self._deleted: Optional[Set[Any]] = None
+
+    def __repr__(self) -> str:
+        return f"State({self.flatten()!r})"
+
+    def __getitem__(self, key: Any) -> Any:
+        try:
+            return self._data[key]
+        except KeyError:
+            if self._deleted and key in self._deleted:
+                raise
+            return self.base[key]
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: Any) -> bool:
+        if key in self._data:
+            return True
+        return key in self.base and not (self._deleted and key in self._deleted)
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._data[key] = value
+        if self._deleted:
+            self._deleted.discard(key)
+
+    def __delitem__(self, key: Any) -> None:
+        in_base = key in self.base and not (self._deleted and key in self._deleted)
+        if key in self._data:
+            del self._data[key]
+        elif not in_base:
+            raise KeyError(key)
+        if in_base:
+            if self._deleted is None:
+                self._deleted = set()
+            self._deleted.add(key)
+
+    def __iter__(self) -> Iterator[Any]:
+        yield from self._data
+        for key in self.base:
+            if key not in self._data and not (self._deleted and key in self._deleted):
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def flatten(self) -> Dict[Any, Any]:
+        """合并为普通字典"""
+        if not self._deleted:
+            data = self.base.flatten() if isinstance(self.base, State) else dict(self.base)
+            data.update(self._data)
+            return data
+        return {key: self[key] for key in self}
+
+    copy = flatten
@@ -7,12 +7,14 @@ import asyncio
 import hashlib
 import inspect
 import re
+from contextlib import asynccontextmanager
 from functools import wraps, partial
 from typing import Any, Dict, TypeVar, Callable
 from typing import (
     Awaitable
 )
 
+import aiohttp
 from loguru import logger
 from pydantic.fields import ModelField
 from pydantic.typing import ForwardRef, evaluate_forwardref
@@ -124,3 +126,35 @@ def MD5(code):
     md5 = hashlib.md5()
     md5.update(code.encode('utf-8'))
     return md5.hexdigest()
+
+
+# 单事件循环模式下进程共享的 aiohttp 会话，(事件循环, 会话)
+_shared_session = None
+
+
+def share_session(session) -> None:
+    """设置当前事件循环共享的 aiohttp 会话，为 ``None`` 时取消共享"""
+    global _shared_session
+    _shared_session = (asyncio.get_running_loop(), session) if session is not None else None
+
+
+@asynccontextmanager
+async def http_session():
+    """
+    :说明:
+
+      获取 aiohttp 会话，当前事件循环设置了共享会话时复用其连接池，否则创建临时会话
+
+    :用法:
+
+    .. code-block:: python
+
+        async with http_session() as sess:
+            async with sess.post(url, json=data) as resp:
+                ...
+    """
+    if _shared_session and _shared_session[0] is asyncio.get_running_loop():
+        yield _shared_session[1]
+        return
+    async with aiohttp.ClientSession() as sess:
+        yield sess
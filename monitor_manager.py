@@ -1,13 +1,19 @@
 import asyncio
 import json
 import threading
-import time
 
-from websocket import create_connection
+from tornado.httpclient import HTTPClientError
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect, WebSocketClosedError, WebSocketError
 
 from classes import Message
+from monitor.config import WS_COMPRESSION_LEVEL, WS_COMPRESSION_MEM_LEVEL, WS_MAX_MESSAGE_SIZE
+from monitor.contacts import contacts, CONTACTS_EVENT, MEMBERS_EVENT
+from monitor.dialog import dialogs
+from monitor.dispatch import dispatcher
+from monitor.ingress import deduplicator, message_key
+from monitor.lifecycle import lifecycle, LIFECYCLE_EVENT
 from monitor.logger import logger
-from monitor.message import handle_event
 from monitor.plugin import load_plugins, load_builtin_plugin
 from wechat.tasks.schedulers import scheduler
 
@@ -17,61 +23,107 @@ class Client:
     def __init__(self, url):
         self.url = url
         self.ws = None
-        self.connection()
-
-    def connection(self):
-        try:
-            self.ws = create_connection(self.url)
-            logger.success('websocket connection success')
-
-        except ConnectionRefusedError:
-            logger.error('websocket connection refuse, reconnecting')
-            time.sleep(2)
-
-            self.connection()
-        except ConnectionResetError:
-            logger.error('websocket connection reset, reconnecting')
-            time.sleep(2)
-
-            self.connection()
-
-    def get_recv(self):
+        # 客户端所在事件循环，其他线程通过该循环发送消息
+        self.loop = None
+        # 通讯录副本版本不连续时请求重新同步
+        contacts.on_gap = self.sync_contacts
+        # 请求 permessage-deflate 压缩，由服务端协商是否启用
+        self.compression_options = {
+            'compression_level': WS_COMPRESSION_LEVEL,
+            'mem_level': WS_COMPRESSION_MEM_LEVEL,
+        } if WS_COMPRESSION_LEVEL else None
+
+    async def connection(self):
         while True:
             try:
-                message = self.ws.recv()
-                if message:
-                    self.__on_message(message)
-            except ConnectionResetError:
-                self.connection()
+                self.ws = await websocket_connect(
+                    self.url,
+                    compression_options=self.compression_options,
+                    max_message_size=WS_MAX_MESSAGE_SIZE,
+                )
+                logger.success('websocket connection success')
+                return
+            # 握手被拒绝（如服务端返回 4xx/5xx）或协议错误时同样重连
+            except (ConnectionError, OSError, HTTPClientError, WebSocketError) as e:
+                logger.error(f'websocket connection failed {e}, reconnecting')
+                await asyncio.sleep(2)
+
+    async def get_recv(self):
+        self.loop = IOLoop.current()
+        # 同一会话的消息按顺序处理，不同会话并行处理
+        dispatcher.start()
+        await self.connection()
+        while True:
+            message = await self.ws.read_message()
+            # 连接断开或消息超出 WS_MAX_MESSAGE_SIZE 时为 None
+            if message is None:
+                logger.error(f'websocket connection closed {self.ws.close_code}, reconnecting')
+                # 重连后服务端会重新推送当前状态
+                lifecycle.set(None)
+                await self.connection()
+                continue
+            self.__on_message(message)
 
     def __on_message(self, message):
         try:
             message = json.loads(message)
+            # 通讯录、群成员推送只更新本地副本
+            if message.get('event') in (CONTACTS_EVENT, MEMBERS_EVENT):
+                contacts.apply(message)
+                return
+            if message.get('event') == LIFECYCLE_EVENT:
+                lifecycle.apply(message)
+                return
+            # 服务端补发或重复推送的消息只处理一次
+            if deduplicator.seen(message_key(message['data'])):
+                logger.debug('duplicate server message ignored %s' % message)
+                return
             logger.info('get server message %s' % message)
             message['wx'] = self
-            asyncio.run(handle_event(Message(**message)))
+            dispatcher.submit(Message(**message))
 
         except Exception as e:
             logger.error('handle message error %s' % e)
 
+    def write(self, message):
+        """发送消息，可在任意线程调用"""
+        size = len(message.encode('utf-8'))
+        if size > WS_MAX_MESSAGE_SIZE:
+            logger.error(f'message of {size} bytes exceeds WS_MAX_MESSAGE_SIZE, dropped')
+            return
+        if not self.loop:
+            logger.warning('websocket not connected, message dropped')
+            return
+        self.loop.add_callback(self._write, message)
+
+    def _write(self, message):
+        try:
+            self.ws.write_message(message)
+        except (AttributeError, WebSocketClosedError):
+            logger.warning('websocket closed, message dropped')
+
     def send(self, send_type, *args, **kwargs):
         message = json.dumps({
             'send_type': send_type,
             'args': args,
             'kwargs': kwargs
         })
-        self.ws.send(message)
+        self.write(message)
+
+    def sync_contacts(self):
+        self.write(json.dumps({'event': 'sync_contacts'}))
 
     def send_text(self, *args, **kwargs):
         self.send('send_text', *args, **kwargs)
 
     def start(self):
-        threading.Thread(target=self.get_recv, args=()).start()
+        asyncio.run(self.get_recv())
 
 
 if __name__ == '__main__':
     load_builtin_plugin('echo')
     load_plugins('wechat/plugins')
+    dialogs.open()
     client = Client('ws://127.0.0.1:3000')
     objs = [client, scheduler]
     for obj in objs:
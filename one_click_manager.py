@@ -1,24 +1,77 @@
+import asyncio
 import threading
 
+import aiohttp
+
+from monitor.contacts import contacts
+from monitor.dialog import dialogs
+from monitor.dispatch import dispatcher
 from monitor.logger import logger
 from monitor.plugin import load_plugins, load_builtin_plugin
+from monitor.utils import share_session
 from web.http import Application
-from wechat import WX
+from wechat import WX, WXFriend, chatroom_members, receive
+from wechat.config import SINGLE_LOOP
+from wechat.tasks import schedulers
 from wechat.tasks.schedulers import scheduler
 
 
-def main():
-    app = Application(logger=logger)
+def load():
     # 加载内置插件 ping
     load_builtin_plugin('echo')
     # 加载自定义微信机器人插件
     load_plugins('wechat/plugins')
+    # 恢复上次未完成的对话
+    dialogs.open()
+
+    # 同进程内直接订阅通讯录变化，先加载本地快照，否则副本中缺少本次启动后未变化的通讯录
+    WXFriend.open()
+    contacts.apply(WXFriend.snapshot())
+    WXFriend.subscribe(contacts.apply)
+    chatroom_members.subscribe(contacts.apply)
+
+
+def main():
+    app = Application(logger=logger)
+    load()
 
-    objs = [WX(), app, scheduler]
+    wx = WX()
+    objs = [wx, app, scheduler]
     for obj in objs:
         _ = threading.Thread(target=obj.start, args=tuple())
         _.start()
 
 
+async def serve():
+    """单事件循环模式，HTTP、定时任务及消息分发均运行在当前事件循环，微信回调线程只负责将消息放入队列"""
+    loop = asyncio.get_running_loop()
+    load()
+
+    dispatcher.start()
+
+    def on_message(message):
+        try:
+            message = receive(message)
+            if message:
+                message.wx = WX()
+                dispatcher.submit(message)
+        except Exception as e:
+            logger.opt(exception=e).error('on_message monitor failed')
+
+    wx = WX(on_message=on_message)
+    Application(logger=logger).listen(5741)
+    schedulers.attach_loop(loop).start()
+
+    async with aiohttp.ClientSession() as session:
+        # 插件通过 http_session 复用同一个连接池
+        share_session(session)
+        # WX.start 阻塞等待登录，在线程中运行
+        await loop.run_in_executor(None, wx.start)
+        await asyncio.Event().wait()
+
+
 if __name__ == '__main__':
-    main()
+    if SINGLE_LOOP:
+        asyncio.run(serve())
+    else:
+        main()
@@ -1,26 +1,24 @@
 import asyncio
 
-from flask import Flask
-from tornado.httpserver import HTTPServer
+import tornado.web
 from tornado.ioloop import IOLoop
-from tornado.wsgi import WSGIContainer
 
 from web.http.app.routers import wechat_app
+from web.http.utils import NotFoundHandler
 
 
-class Application:
-    app = Flask(__name__)
+class Application(tornado.web.Application):
 
     def __init__(self, logger=None):
-        self.__load_routers()
         self.logger = logger
+        super().__init__(self.__load_routers(), default_handler_class=NotFoundHandler)
 
-    def __load_routers(self):
+    @staticmethod
+    def __load_routers():
         # 加载所有的二级路由APP
-        self.app.register_blueprint(blueprint=wechat_app)
+        return [*wechat_app]
 
     def start(self, port=5741):
         asyncio.set_event_loop(asyncio.new_event_loop())
-        http_server = HTTPServer(WSGIContainer(self.app))
-        http_server.listen(port)
-        IOLoop.instance().start()
+        self.listen(port)
+        IOLoop.current().start()
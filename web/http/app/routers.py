@@ -1,11 +1,23 @@
 # APP对应路由
-# 导入蓝图（Blueprint)
-from flask import Blueprint
+from web.http.app.views import SendTextMsg, GetInfo, CallBackWechat, ChatroomMembers, MemberChatrooms, BatchSend, \
+    BatchStatus, PollMessages, StreamMessages, WebSocketStats, \
+    Ready, DispatchStats
 
-# 使用蓝图创建一个app对象 url_prefix 为设置url前缀
-from web.http.app.views import send_text_msg, GetInfo, CallBackWechat
+# url 前缀
+url_prefix = '/wechat'
 
-wechat_app = Blueprint('wechat_app', __name__, url_prefix='/wechat')
-wechat_app.add_url_rule('/message/to', None, send_text_msg, methods=['POST'])
-wechat_app.add_url_rule('/friends/<friend_type>', None, GetInfo.as_view("get_info"), methods=['GET', 'POST'])
-wechat_app.add_url_rule('/callback/<function>', None, CallBackWechat.as_view("callback_wechat"), methods=['POST'])
+wechat_app = [
+    (r'/message/to', SendTextMsg),
+    (r'/message/batch', BatchSend),
+    (r'/message/batch/(?P<job_id>[0-9a-f]+)', BatchStatus),
+    (r'/friends/(?P<friend_type>[^/]+)', GetInfo),
+    (r'/callback/(?P<function>[^/]+)', CallBackWechat),
+    (r'/chatroom/(?P<chatroom_id>[^/]+)/members', ChatroomMembers),
+    (r'/member/(?P<wxid>[^/]+)/chatrooms', MemberChatrooms),
+    (r'/messages', PollMessages),
+    (r'/messages/stream', StreamMessages),
+    (r'/stats/websocket', WebSocketStats),
+    (r'/ready', Ready),
+    (r'/stats/dispatch', DispatchStats),
+]
+wechat_app = [(url_prefix + pattern, handler) for pattern, handler in wechat_app]
@@ -1,74 +1,321 @@
+import asyncio
 import json
+import time
 
-from flask import views, request, Response, stream_with_context
+from tornado.iostream import StreamClosedError
 
-from web.http.utils import global_response, get_param
-from wechat import WXFriend, WX
+from web.http.utils import BaseHandler, response_data, dumps, run_blocking, VersionedCache
+from monitor.dialog import dialogs
+from monitor.dispatch import dispatcher
+from monitor.ingress import deduplicator, flood_control
+from monitor.lifecycle import lifecycle, READY
+from web.ws.socket import UpdateWebSocket
+from wechat import WXFriend, WX, chatroom_members, outbox, message_stream
+from wechat.config import OUTBOX_MAX_BATCH, MESSAGE_POLL_TIMEOUT, MESSAGE_SSE_HEARTBEAT
+from wechat.contacts import CONTACT_TYPES
 
+# 通讯录分页序列化缓存，按通讯录版本失效
+contact_pages = VersionedCache()
+# 通讯录单页最大条数
+MAX_PAGE_LIMIT = 1000
+# 通讯录搜索结果每输出多少条刷新一次
+STREAM_FLUSH_SIZE = 200
+# 消息流单次最多返回条数
+MAX_MESSAGE_LIMIT = 500
+# 消息流可用的过滤字段
+MESSAGE_FILTERS = ('chat_type', 'friend', 'group', 'user')
 
-def send_text_msg():
-    success, json_data = get_param(request)
-    if not success:
-        return json_data
-    msg = json_data.get('msg')
-    friend_id = json_data.get('friend_id')
-    if msg:
-        WX().send_text(friend_id, msg=msg)
 
-    return global_response(data={'friend_id': friend_id, 'send_msg': msg}, msg='Message Send Successful')
+class SendTextMsg(BaseHandler):
 
+    async def post(self):
+        if not self.require_login():
+            return
+        json_data = self.get_param()
+        if json_data is None:
+            return
+        msg = json_data.get('msg')
+        friend_id = json_data.get('friend_id')
+        if msg:
+            await run_blocking(WX().send_text, friend_id, msg=msg)
 
-class GetInfo(views.MethodView):
-    # 可省略
-    methods = ["GET", "POST"]
+        self.global_response(data={'friend_id': friend_id, 'send_msg': msg}, msg='Message Send Successful')
+
+
+class BatchSend(BaseHandler):
+
+    def post(self):
+        """
+        批量发送文本消息，消息进入发送队列后立即返回任务 id，队列已满时返回 429
+        :param items: [{"friend_id": "wxid", "msg": "消息"}, ...]
+        """
+        if not self.require_login():
+            return
+        json_data = self.get_param()
+        if json_data is None:
+            return
+        items = json_data.get('items')
+        if not isinstance(items, list) or not 0 < len(items) <= OUTBOX_MAX_BATCH:
+            return self.global_response(status=400, msg=f'items must be a list of 1-{OUTBOX_MAX_BATCH}')
+        try:
+            items = [(item['friend_id'], item['msg']) for item in items]
+        except (KeyError, TypeError):
+            return self.global_response(status=400, msg='item must contain friend_id and msg')
+
+        job = outbox.submit(items)
+        if job is None:
+            # 发送队列已满，稍后重试
+            self.set_header('Retry-After', '10')
+            return self.global_response(status=429, msg='Outbox Full')
+        self.global_response(data={'job_id': job.id, 'total': len(job.items)}, status=202,
+                             msg='Message Batch Queued')
+
+
+class BatchStatus(BaseHandler):
+
+    def get(self, job_id):
+        """查询批量发送任务中每条消息的发送状态及耗时（毫秒）"""
+        job = outbox.get(job_id)
+        if not job:
+            return self.global_response(status=404)
+        self.global_response(data=job.to_dict(), msg='Get Message Batch Success')
+
+
+class GetInfo(BaseHandler):
 
     def get(self, friend_type):
-        return global_response(data=getattr(WXFriend, friend_type), msg='Get Friends\'s Info Success')
+        """
+        获取通讯录，支持分页、字段筛选及 ETag 缓存校验
+        :param cursor: 上一页返回的 next_cursor
+        :param limit: 每页条数，不传时返回全部
+        :param fields: 返回字段，逗号分隔
+        """
+        if friend_type not in CONTACT_TYPES:
+            return self.global_response(status=404)
+        if self.if_none_match(WXFriend.etag):
+            return
+
+        cursor = self.get_query_argument('cursor', None) or None
+        limit = self.get_query_argument('limit', None)
+        fields = self.get_query_argument('fields', None)
+        if limit is not None:
+            if not limit.isdigit() or not 0 < int(limit) <= MAX_PAGE_LIMIT:
+                return self.global_response(status=400, msg=f'limit must be in 1-{MAX_PAGE_LIMIT}')
+            limit = int(limit)
+        fields = tuple(field for field in fields.split(',') if field) if fields else None
+
+        key = (friend_type, cursor, limit, fields)
+        body = contact_pages.get(WXFriend.etag, key)
+        if body is None:
+            page, next_cursor, etag = WXFriend.page(friend_type, cursor=cursor, limit=limit, fields=fields)
+            data = page if limit is None else {'contacts': page, 'next_cursor': next_cursor}
+            body = dumps(response_data(data=data, msg='Get Friends\'s Info Success')[0])
+            contact_pages.put(etag, key, body)
+        else:
+            etag = contact_pages.version
+        self.etag_response(body, etag)
 
-    def post(self, friend_type):
-        success, json_data = get_param(request)
-        if not success:
-            return json_data
+    async def post(self, friend_type):
+        if friend_type not in CONTACT_TYPES:
+            return self.global_response(status=404)
+        json_data = self.get_param()
+        if json_data is None:
+            return
         name = json_data.get('name')
         type_ = json_data.get('type_')
-        if name:
-            def stream():
-                yield '['
-                for _, friend in getattr(WXFriend, friend_type).items():
-                    if type_:
-                        if name in friend.get(type_):
-                            friend['_id'] = _
-                            yield json.dumps(friend)
-                            yield ',\n'
-                    else:
-                        try:
-                            if name in friend['name'] or name in _ or name in friend['remark_name']:
-                                friend['_id'] = _
-                                yield json.dumps(friend)
-                                yield ',\n'
-                        except:
-                            pass
-
-                yield ']'
-
-            return Response(stream_with_context(stream()), mimetype='application/json')
-        else:
-            return global_response(data={}, msg='Get ({})\'s Info Failed'.format(name))
+        if not name:
+            return self.global_response(data={}, msg='Get ({})\'s Info Failed'.format(name))
+
+        # 分段输出搜索结果，每段输出后让出事件循环
+        self.write('[')
+        count = 0
+        for _, friend in list(WXFriend.of_type(friend_type).items()):
+            try:
+                if type_:
+                    matched = name in friend.get(type_)
+                else:
+                    matched = name in friend['name'] or name in _ or name in friend['remark_name']
+            except Exception:
+                continue
+            if matched:
+                self.write((',\n' if count else '') + json.dumps(dict(friend, _id=_)))
+                count += 1
+                if not count % STREAM_FLUSH_SIZE:
+                    await self.flush()
+        self.finish(']')
+
+
+class ChatroomMembers(BaseHandler):
+
+    def get(self, chatroom_id):
+        """获取群成员，未缓存时发起刷新并返回 202"""
+        members = chatroom_members.members(chatroom_id)
+        if not chatroom_members.cached(chatroom_id):
+            return self.global_response(data={'chatroom': chatroom_id, 'members': []}, status=202,
+                                        msg='Members Not Cached, Refreshing')
+        self.global_response(data={'chatroom': chatroom_id, 'members': sorted(members)},
+                             msg='Get Chatroom Members Success')
+
+
+class MemberChatrooms(BaseHandler):
+
+    def get(self, wxid):
+        """获取成员所在的所有已缓存的群"""
+        self.global_response(data={'wxid': wxid, 'chatrooms': sorted(chatroom_members.chatrooms(wxid))},
+                             msg='Get Member Chatrooms Success')
+
+
+def _message_filter(conditions):
+    """按字段取值过滤消息，conditions 为 {字段: 可选值集合}"""
+    def filter_(message):
+        return all(message.get(field) in values for field, values in conditions.items())
+    return filter_
+
 
+class MessageHandler(BaseHandler):
+    """消息流接口基类，解析游标、条数及过滤参数"""
 
-class CallBackWechat(views.MethodView):
+    def parse_stream_args(self, cursor=None):
+        """
+        解析消息流参数，参数不合法时返回 400 并返回 None
+        :param cursor: 已读取的最后一条消息序号，不传时只读取新消息
+        :param limit: 单次最多返回条数
+        :param chat_type, friend, group, user: 按字段过滤消息，多个值用逗号分隔
+        :return: 空 | (游标, 条数, 过滤函数)
+        """
+        cursor = cursor or self.get_query_argument('cursor', None)
+        limit = self.get_query_argument('limit', '100')
+        if cursor is not None and not cursor.isdigit():
+            self.global_response(status=400, msg='cursor must be a non-negative integer')
+            return None
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_MESSAGE_LIMIT:
+            self.global_response(status=400, msg=f'limit must be in 1-{MAX_MESSAGE_LIMIT}')
+            return None
+        cursor = message_stream.seq if cursor is None else int(cursor)
+
+        conditions = {}
+        for field in MESSAGE_FILTERS:
+            value = self.get_query_argument(field, None)
+            if value:
+                conditions[field] = frozenset(value.split(','))
+        return cursor, int(limit), _message_filter(conditions) if conditions else None
+
+
+class PollMessages(MessageHandler):
+
+    async def get(self):
+        """
+        长轮询读取消息，游标之后没有消息时最多等待 timeout 秒
+        :param timeout: 等待时间（秒）
+        :return: {"messages": [...], "next_cursor": int, "lost": 游标过旧而丢失的条数}
+        """
+        args = self.parse_stream_args()
+        if args is None:
+            return
+        cursor, limit, filter_ = args
+        timeout = self.get_query_argument('timeout', str(MESSAGE_POLL_TIMEOUT))
+        try:
+            timeout = min(max(float(timeout), 0), MESSAGE_POLL_TIMEOUT)
+        except ValueError:
+            return self.global_response(status=400, msg='timeout must be a number')
+
+        messages, cursor, lost = message_stream.read(cursor, limit, filter_)
+        deadline = time.monotonic() + timeout
+        # 新消息可能被过滤，继续等待直至超时
+        while not messages and not lost and deadline > time.monotonic():
+            if not await message_stream.wait(cursor, deadline - time.monotonic()):
+                break
+            messages, cursor, lost = message_stream.read(cursor, limit, filter_)
+        self.global_response(data={'messages': messages, 'next_cursor': cursor, 'lost': lost},
+                             msg='Get Messages Success')
+
+
+class StreamMessages(MessageHandler):
+
+    def initialize(self):
+        self.closed = False
+
+    def on_connection_close(self):
+        self.closed = True
+
+    async def get(self):
+        """
+        SSE 推送消息，断线重连时通过 Last-Event-ID 请求头或 cursor 参数续读；
+        游标过旧时先推送 ``lost`` 事件，数据为丢失的条数
+        """
+        args = self.parse_stream_args(self.request.headers.get('Last-Event-ID'))
+        if args is None:
+            return
+        cursor, limit, filter_ = args
+
+        self.set_header('Content-Type', 'text/event-stream; charset=UTF-8')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Accel-Buffering', 'no')
+        try:
+            self.write('retry: 3000\n\n')
+            await self.flush()
+            while not self.closed:
+                messages, cursor, lost = message_stream.read(cursor, limit, filter_)
+                if lost:
+                    self.write(f'event: lost\ndata: {lost}\n\n')
+                for message in messages:
+                    self.write(f'id: {message["seq"]}\nevent: message\ndata: {dumps(message)}\n\n')
+                if messages or lost:
+                    await self.flush()
+                elif not await message_stream.wait(cursor, MESSAGE_SSE_HEARTBEAT):
+                    self.write(': ping\n\n')
+                    await self.flush()
+        except StreamClosedError:
+            pass
+
+
+class Ready(BaseHandler):
+
+    async def get(self):
+        """
+        微信就绪状态，就绪时返回 200，否则返回 503
+        :param timeout: 未就绪时最多等待的秒数，默认不等待
+        """
+        timeout = self.get_query_argument('timeout', '0')
+        try:
+            timeout = min(max(float(timeout), 0), MESSAGE_POLL_TIMEOUT)
+        except ValueError:
+            return self.global_response(status=400, msg='timeout must be a number')
+        ready = lifecycle.reached(READY) or (timeout and await lifecycle.wait_for(READY, timeout))
+        self.global_response(data=lifecycle.snapshot(), status=200 if ready else 503,
+                             msg='Wechat Ready' if ready else 'Wechat Not Ready')
+
+
+class WebSocketStats(BaseHandler):
+
+    async def get(self):
+        """websocket 客户端推送统计：未发出字节数、待发送消息数、丢弃数等"""
+        # 客户端状态只在 websocket 服务的事件循环中修改，在该循环中生成统计
+        data = await asyncio.wrap_future(UpdateWebSocket.stats_snapshot())
+        self.global_response(data=data, msg='Get WebSocket Stats Success')
+
+
+class DispatchStats(BaseHandler):
+
+    def get(self):
+        """单事件循环模式下的消息分发统计：排队数、处理中数、按原因统计的丢弃数、暂停中的对话、重复消息过滤及限流"""
+        data = dict(dispatcher.stats(), dialogs=dialogs.stats(), dedup=deduplicator.stats(),
+                    flood=flood_control.stats())
+        self.global_response(data=data, msg='Get Dispatch Stats Success')
+
+
+class CallBackWechat(BaseHandler):
     """微信接口回调函数"""
-    # 可省略
-    methods = ["POST"]
-
-    def post(self, function):
-        success, json_data = get_param(request)
-        if not success:
-            return json_data
-        if hasattr(WX(), function):
+
+    async def post(self, function):
+        if not self.require_login():
+            return
+        json_data = self.get_param()
+        if json_data is None:
+            return
+        if not function.startswith('_') and hasattr(WX(), function):
             function = getattr(WX(), function)
-            res = function(**json_data)
-            print(res)
+            res = await run_blocking(function, **json_data)
             if res:
-                return global_response(data=res)
-        return global_response()
+                return self.global_response(data=res)
+        self.global_response()
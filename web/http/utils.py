@@ -1,9 +1,20 @@
+import json
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Hashable, Optional
 
-from flask import jsonify
+import tornado.web
+from tornado.escape import json_decode
+from tornado.ioloop import IOLoop
+
+from monitor.lifecycle import lifecycle, LOGGED_IN
+from wechat.config import HTTP_WORKERS
 
 STATUS_CODE_DICT = {
     200: 'Success',
+    202: 'Accepted',
     400: 'Bad Request',
     401: 'Unauthorized',
     403: 'Forbidden',
@@ -16,8 +27,12 @@ STATUS_CODE_DICT = {
 
 }
 
+# 执行微信接口等阻塞调用的线程池，防止阻塞事件循环
+executor = ThreadPoolExecutor(max_workers=HTTP_WORKERS, thread_name_prefix='http-worker')
+
 
-def global_response(data=None, status=None, msg=None):
+def response_data(data=None, status=None, msg=None):
+    """构造统一的返回结构，返回 (返回结构, 状态码)"""
     if msg is None:
         if not status:
             status = 200 if data else 404
@@ -32,21 +47,104 @@ def global_response(data=None, status=None, msg=None):
         'status': status,
         'timestamp': int(time.time())
     }
-    return jsonify(data), status
+    return data, status
 
 
-def get_param(request):
-    """获取 Flask 请求参数, POST GET"""
-    if request.method == 'POST':
-        content_type = request.headers.get('Content-Type')
-        if content_type == 'application/json':
-            json_data = request.json
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False)
 
-        elif 'form-data' in content_type:
-            json_data = request.form
 
-        else:
-            return False, global_response(status=400)
-    else:
-        json_data = request.args
-    return True, json_data
+async def run_blocking(func, *args, **kwargs):
+    """在线程池中执行阻塞调用"""
+    return await IOLoop.current().run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    """接口基类，统一返回结构"""
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+
+    def global_response(self, data=None, status=None, msg=None):
+        data, status = response_data(data, status, msg)
+        self.set_status(status)
+        self.finish(dumps(data))
+
+    def etag_response(self, body, etag):
+        """返回已序列化的 json 并携带 ETag"""
+        self.set_header('Etag', f'"{etag}"')
+        self.finish(body)
+
+    def if_none_match(self, etag):
+        """请求的 If-None-Match 是否与 etag 一致，一致时直接返回 304"""
+        if_none_match = self.request.headers.get('If-None-Match', '')
+        if f'"{etag}"' in if_none_match or if_none_match.strip() == '*':
+            self.set_header('Etag', f'"{etag}"')
+            self.set_status(304)
+            self.finish()
+            return True
+        return False
+
+    def require_login(self):
+        """微信未登录时返回 503 并返回 False"""
+        if lifecycle.reached(LOGGED_IN):
+            return True
+        self.set_header('Retry-After', '1')
+        self.global_response(data={'state': lifecycle.state}, status=503, msg='Wechat Not Logged In')
+        return False
+
+    def get_param(self):
+        """获取请求参数, POST GET，参数格式不支持时返回 400 并返回 None"""
+        if self.request.method == 'POST':
+            content_type = self.request.headers.get('Content-Type', '')
+            if content_type.startswith('application/json'):
+                try:
+                    return json_decode(self.request.body) or {}
+                except ValueError:
+                    self.global_response(status=400)
+                    return None
+
+            elif 'form-data' in content_type or 'x-www-form-urlencoded' in content_type:
+                return {k: self.get_body_argument(k) for k in self.request.body_arguments}
+
+            else:
+                self.global_response(status=400)
+                return None
+        return {k: self.get_query_argument(k) for k in self.request.query_arguments}
+
+    def write_error(self, status_code, **kwargs):
+        data, _ = response_data(status=status_code if status_code in STATUS_CODE_DICT else 500)
+        self.finish(dumps(data))
+
+
+class NotFoundHandler(BaseHandler):
+    def prepare(self):
+        self.global_response(status=404)
+
+
+class VersionedCache:
+    """
+    按版本缓存序列化结果，版本变化后清空旧缓存
+    :param maxsize: 单个版本最多缓存的条数
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.version: Optional[Hashable] = None
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, version: Hashable, key: Hashable) -> Any:
+        if version != self.version:
+            return None
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, version: Hashable, key: Hashable, value: Any) -> None:
+        if version != self.version:
+            self.version = version
+            self._data = OrderedDict()
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
@@ -9,16 +9,19 @@ import tornado.websocket
 from tornado.options import options
 
 from web.ws.socket import UpdateWebSocket
+from monitor.config import WS_MAX_MESSAGE_SIZE
 
 
 class WSApplication(tornado.web.Application):
     def __init__(self):
         handlers = [(r"/", UpdateWebSocket)]
-        settings = dict(debug=True)
+        settings = dict(debug=True, websocket_max_message_size=WS_MAX_MESSAGE_SIZE)
         tornado.web.Application.__init__(self, handlers, **settings)
 
     def start(self):
         asyncio.set_event_loop(asyncio.new_event_loop())
         tornado.options.parse_command_line()
+        # 记录 websocket 所在事件循环，其他线程通过该循环推送消息
+        UpdateWebSocket.loop = tornado.ioloop.IOLoop.current()
         self.listen(options.port)
         tornado.ioloop.IOLoop.instance().start()
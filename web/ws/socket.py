@@ -1,19 +1,62 @@
-import asyncio
 import json
 import traceback
 from abc import ABC
+from concurrent.futures import Future
+from collections import deque
 
 import tornado.websocket
+from tornado.ioloop import IOLoop
 from tornado.options import define
 
-from wechat import get_friends, WXFriend, START_TIME, logger, WX, Message
+from wechat import ingest, WXFriend, logger, WX, chatroom_members, message_stream
+from monitor.lifecycle import lifecycle
+from monitor.config import WS_COMPRESSION_LEVEL, WS_COMPRESSION_MEM_LEVEL, WS_MAX_MESSAGE_SIZE
+from wechat.config import WS_MAX_BUFFER, WS_SLOW_POLICY, WS_BACKLOG_SIZE
 
 define("port", default=3000, help="run on the given port", type=int)
 
 all_user_collections = set()
 
+# 慢客户端处理策略
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+SPILL = 'spill'
+# spill 策略下每次从消息流补发的条数
+REPLAY_BATCH = 100
+
 
 class UpdateWebSocket(tornado.websocket.WebSocketHandler, ABC):
+    # websocket 服务所在事件循环，由 WSApplication.start 设置
+    loop: IOLoop = None
+    # 因处理过慢被断开的客户端数
+    slow_disconnects = 0
+
+    def initialize(self, policy=WS_SLOW_POLICY, max_buffer=WS_MAX_BUFFER, backlog_size=WS_BACKLOG_SIZE):
+        self.policy = policy
+        self.max_buffer = max_buffer
+        self.backlog_size = backlog_size
+        # 已交给 tornado 但尚未写入 socket 的字节数
+        self.buffered = 0
+        self.max_buffered = 0
+        # 超出上限后等待发送的聊天消息 (消息, 序号, 字节数)，超出条数或字节上限时丢弃最早的
+        self.backlog = deque()
+        self.backlog_bytes = 0
+        # 超出上限后等待发送的通讯录、群成员及登录状态推送 (消息, 字节数)，不丢弃
+        self.control = deque()
+        self.control_bytes = 0
+        # spill 策略下暂停推送时已推送的最后一条消息序号
+        self.spill_cursor = None
+        self.last_seq = message_stream.seq
+        self.sent = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    def get_compression_options(self):
+        # 客户端请求时启用 permessage-deflate 压缩
+        if WS_COMPRESSION_LEVEL:
+            return {'compression_level': WS_COMPRESSION_LEVEL, 'mem_level': WS_COMPRESSION_MEM_LEVEL}
+        return None
+
     # 检查跨域请求，容许跨域，则直接return True，不然自定义筛选条件
     def check_origin(self, origin):
         return True
@@ -24,12 +67,20 @@ class UpdateWebSocket(tornado.websocket.WebSocketHandler, ABC):
 
         # 初始化
         all_user_collections.add(self)
+        # 推送全量通讯录及群成员，之后只推送增量变化
+        self._send(json.dumps(WXFriend.snapshot()))
+        self._send(json.dumps(chatroom_members.snapshot()))
+        self._send(json.dumps(lifecycle.snapshot()))
 
     # 关闭链接的时候须要清空链接用户
     def on_close(self):
         logger.info("client %s closed" % (id(self)))
 
         all_user_collections.remove(self)
+        self.backlog.clear()
+        self.control.clear()
+        self.backlog_bytes = self.control_bytes = 0
+        self.spill_cursor = None
         try:
             self.close()
         except:
@@ -42,6 +93,11 @@ class UpdateWebSocket(tornado.websocket.WebSocketHandler, ABC):
             message = json.loads(message)
             logger.info('get client message %s' % message)
 
+            # 客户端通讯录副本版本不连续，重新推送全量通讯录
+            if message.get('event') == 'sync_contacts':
+                self.deliver(json.dumps(WXFriend.snapshot()))
+                return
+
             # 获取回调函数以及参数
             send_type = message.get('send_type')
             args = message.get('args')
@@ -56,6 +112,164 @@ class UpdateWebSocket(tornado.websocket.WebSocketHandler, ABC):
         except Exception as e:
             logger.info('message error %s' % e)
 
+    def deliver(self, message: str, seq: int = None):
+        """
+        推送一条消息，未发出数据超出上限时按策略处理
+        :param message: 已序列化的消息
+        :param seq: 消息流序号，仅聊天消息有；没有序号的通讯录、群成员及登录状态推送不丢弃
+        """
+        if seq is not None:
+            # spill 补发时已发送过的消息
+            if seq <= self.last_seq or self.spill_cursor is not None:
+                return
+        if self.buffered <= self.max_buffer and not self.backlog and not self.control:
+            self._send(message, seq)
+            return
+
+        if self.policy == DISCONNECT:
+            self._disconnect()
+            self.dropped += 1
+        elif seq is None:
+            # 丢失的群成员及登录状态推送无法被客户端发现，积压过多时断开连接，重连后重新推送全量状态
+            size = len(message.encode('utf-8'))
+            if self.control_bytes + size > self.max_buffer:
+                self._disconnect()
+                return
+            self.control.append((message, size))
+            self.control_bytes += size
+        elif self.policy == SPILL:
+            # 暂停推送聊天消息，恢复后从消息流补发
+            self.spill_cursor = self.last_seq
+            self.spilled += 1
+        else:
+            size = len(message.encode('utf-8'))
+            self.backlog.append((message, seq, size))
+            self.backlog_bytes += size
+            while len(self.backlog) > self.backlog_size or self.backlog_bytes > self.max_buffer:
+                _, _, size = self.backlog.popleft()
+                self.backlog_bytes -= size
+                self.dropped += 1
+
+    def _disconnect(self):
+        """断开处理过慢的客户端"""
+        if self.ws_connection and not self.ws_connection.is_closing():
+            logger.warning(f'client {id(self)} too slow, {self.buffered} bytes buffered, disconnect')
+            UpdateWebSocket.slow_disconnects += 1
+            self.close(1013, 'slow consumer')
+
+    def _send(self, message: str, seq: int = None, size: int = None):
+        """发送消息，连接已关闭时返回 False"""
+        # 按编码后的字节数计算，中文消息每个字符占 3 个字节
+        if size is None:
+            size = len(message.encode('utf-8'))
+        if size > WS_MAX_MESSAGE_SIZE:
+            # 超出客户端接收上限的消息会导致客户端断开连接，直接丢弃
+            logger.error(f'message of {size} bytes exceeds WS_MAX_MESSAGE_SIZE, dropped')
+            self.dropped += 1
+            return True
+        if self.ws_connection is None or self.ws_connection.is_closing():
+            return False
+        try:
+            future = self.write_message(message)
+        except tornado.websocket.WebSocketClosedError:
+            return False
+        self.buffered += size
+        self.max_buffered = max(self.max_buffered, self.buffered)
+        self.sent += 1
+        if seq is not None:
+            self.last_seq = seq
+        future.add_done_callback(lambda _: self._drained(size))
+        return True
+
+    def _drained(self, size: int):
+        """数据写入 socket 后，未发出数据低于上限一半时继续发送缓存及补发消息，状态推送优先"""
+        self.buffered -= size
+        while self.buffered <= self.max_buffer // 2:
+            if self.control:
+                message, size = self.control.popleft()
+                self.control_bytes -= size
+                if not self._send(message, None, size):
+                    return
+            elif self.backlog:
+                message, seq, size = self.backlog.popleft()
+                self.backlog_bytes -= size
+                if seq <= self.last_seq:
+                    continue
+                if not self._send(message, seq, size):
+                    return
+            elif self.spill_cursor is not None:
+                messages, cursor, lost = message_stream.read(self.spill_cursor, REPLAY_BATCH)
+                self.dropped += lost
+                self.last_seq = max(self.last_seq, cursor)
+                # 已追上消息流，恢复实时推送
+                self.spill_cursor = cursor if len(messages) >= REPLAY_BATCH else None
+                for message in messages:
+                    seq = message['seq']
+                    message = {key: value for key, value in message.items() if key != 'seq'}
+                    if not self._send(json.dumps(message), seq):
+                        return
+            else:
+                return
+
+    def stats(self):
+        """当前客户端推送统计"""
+        return {
+            'client': id(self),
+            'remote': self.request.remote_ip,
+            'policy': self.policy,
+            'buffered': self.buffered,
+            'max_buffered': self.max_buffered,
+            'backlog': len(self.backlog),
+            'backlog_bytes': self.backlog_bytes,
+            'control_backlog': len(self.control),
+            'lagging': self.spill_cursor is not None,
+            'last_seq': self.last_seq,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+        }
+
+    @classmethod
+    def all_stats(cls):
+        """所有客户端推送统计"""
+        return {
+            'clients': [collection.stats() for collection in list(all_user_collections)],
+            'slow_disconnects': cls.slow_disconnects,
+        }
+
+    @classmethod
+    def stats_snapshot(cls) -> Future:
+        """在 websocket 服务所在事件循环中生成推送统计，可在任意线程调用"""
+        future = Future()
+
+        def collect():
+            try:
+                future.set_result(cls.all_stats())
+            except Exception as e:
+                future.set_exception(e)
+
+        if cls.loop:
+            cls.loop.add_callback(collect)
+        else:
+            collect()
+        return future
+
+    @classmethod
+    def broadcast(cls, message: str, seq: int = None):
+        """推送消息至所有客户端，可在任意线程调用"""
+        if cls.loop:
+            cls.loop.add_callback(cls._write_all, message, seq)
+
+    @classmethod
+    def _write_all(cls, message: str, seq: int = None):
+        for collection in list(all_user_collections):
+            collection.deliver(message, seq)
+
+    @classmethod
+    def publish(cls, frame):
+        """通讯录、群成员及登录状态变化回调，推送增量变化至所有客户端"""
+        cls.broadcast(json.dumps(frame))
+
     @classmethod
     def send_message(cls, message):
         """
@@ -64,32 +278,15 @@ class UpdateWebSocket(tornado.websocket.WebSocketHandler, ABC):
         :return:
         """
         try:
-            asyncio.set_event_loop(asyncio.new_event_loop())
-
-            res = get_friends(message, WXFriend=WXFriend)
+            # 与单进程模式相同的消息入口，去重及限流后写入消息流
+            res = ingest(message)
 
-            # 判断是否为通讯录消息
+            # 收取的消息并时间大于启动时间才会推送
             if res:
-                data, chat_type, group, user, msg = res
-
-                # 解析当前消息收发状态
-                try:
-                    send_or_recv = not bool(eval(data.get('send_or_recv', '').split('+', 1)[0]))
-                except:
-                    send_or_recv = False
-
-                # 判断为收取消息并时间大于启动时间才会进行回复
-                if send_or_recv and data.get('time') >= START_TIME:
-
-                    if all_user_collections:
-                        logger.info('message: %s' % message)
-                    else:
-                        logger.warning('haven\'t user_collections')
-                    for collection in all_user_collections:
-                        logger.info('collection %s' % id(collection))
-                        friend = group or user
-                        message = json.dumps(Message(data, chat_type, friend, group, user, msg).__dict__)
-                        collection.write_message(message)
+                received, record = res
+                if not all_user_collections:
+                    logger.warning('haven\'t user_collections')
+                cls.broadcast(json.dumps(received.__dict__), record['seq'])
 
         except Exception:
             logger.info('on_message monitor failed %s' % traceback.print_exc())
@@ -1,12 +1,17 @@
 import threading
 
+from monitor.lifecycle import lifecycle
 from monitor.logger import logger
 from web.http import Application
 from web.ws import WSApplication
 from web.ws.socket import UpdateWebSocket
-from wechat import WX
+from wechat import WX, WXFriend, chatroom_members
 
 if __name__ == "__main__":
+    # 通讯录、群成员及登录状态变化通过 websocket 推送至监听服务
+    WXFriend.subscribe(UpdateWebSocket.publish)
+    chatroom_members.subscribe(UpdateWebSocket.publish)
+    lifecycle.subscribe(UpdateWebSocket.publish)
     objs = [WX(on_message=UpdateWebSocket.send_message), WSApplication(), Application(logger=logger)]
     for obj in objs:
         _ = threading.Thread(target=obj.start, args=tuple())
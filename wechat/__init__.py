@@ -1,14 +1,24 @@
 import asyncio
-import time
+import threading
 import traceback
 
 from WechatPCAPI import WechatPCAPI
 
 from classes import Message
+from monitor.dispatch import classify, flood_admit
+from monitor.ingress import deduplicator, message_key
+from monitor.lifecycle import lifecycle, STARTING, LOGGED_IN, DEGRADED, CONTACTS_SYNCED, READY
 from monitor.logger import logger
 from monitor.message import handle_event
-from wechat.config import START_TIME
-from wechat.utils import get_friends
+from wechat.config import CONTACT_SNAPSHOT_DIR, CONTACT_COMPACT_THRESHOLD, CONTACT_BATCH_SIZE, \
+    CONTACT_BATCH_INTERVAL, MEMBER_TTL, MEMBER_REQUEST_TIMEOUT, MEMBER_REFRESH_INTERVAL, MEMBER_REFRESH_BATCH, \
+    OUTBOX_SEND_INTERVAL, OUTBOX_MAX_JOBS, OUTBOX_MAX_PENDING, MESSAGE_STREAM_SIZE, LOGIN_POLL_INTERVAL, CONTACT_SYNC_QUIET, \
+    CONTACT_SYNC_TIMEOUT
+from wechat.contacts import ContactStore, ContactIngestor
+from wechat.members import MembershipCache
+from wechat.outbox import Outbox
+from wechat.stream import MessageStream
+from wechat.utils import get_received
 
 
 # 单例模式
@@ -23,10 +33,28 @@ def singleton(cls, *args, **kw):
     return _singleton
 
 
-class WXFriend:
-    person = {}
-    chatroom = {}
-    gh = {}
+# 通讯录，由持有微信登录的进程在 WX 初始化时加载本地快照
+WXFriend = ContactStore(CONTACT_SNAPSHOT_DIR, compact_threshold=CONTACT_COMPACT_THRESHOLD)
+# 通讯录回调批量写入
+contact_ingestor = ContactIngestor(WXFriend, batch_size=CONTACT_BATCH_SIZE, interval=CONTACT_BATCH_INTERVAL)
+# 群成员缓存，登录后在后台刷新所有群
+chatroom_members = MembershipCache(
+    lambda chatroom: WX().get_member_of_chatroom(chatroom),
+    ttl=MEMBER_TTL,
+    request_timeout=MEMBER_REQUEST_TIMEOUT,
+    refresh_interval=MEMBER_REFRESH_INTERVAL,
+    refresh_batch=MEMBER_REFRESH_BATCH,
+    chatrooms=lambda: list(WXFriend.chatroom),
+)
+# 批量发送队列
+outbox = Outbox(
+    lambda friend_id, msg: WX().send_text(friend_id, msg=msg),
+    interval=OUTBOX_SEND_INTERVAL,
+    max_jobs=OUTBOX_MAX_JOBS,
+    max_pending=OUTBOX_MAX_PENDING,
+)
+# 收到的聊天消息，供 HTTP 接口以 SSE 或长轮询方式读取
+message_stream = MessageStream(MESSAGE_STREAM_SIZE)
 
 
 @singleton
@@ -34,6 +62,41 @@ class WxINFO:
     friend = WXFriend
 
 
+def ingest(message):
+    """
+    解析回调消息，通讯录及群成员消息写入缓存，收到的聊天消息经过去重后写入消息流，限流在分发前进行
+    :param message: 回调消息
+    :return: 空 | (收到的聊天消息, 消息流中带序号的消息)
+    """
+    # 通讯录消息直接进入批量写入队列，不参与消息分发
+    if contact_ingestor.offer(message) or chatroom_members.offer(message):
+        return
+    res = get_received(message)
+
+    # 收取的消息并时间大于启动时间才会进行回复
+    if res:
+        data, chat_type, group, user, msg = res
+        # 重连后微信可能重复回调同一条消息
+        if deduplicator.seen(message_key(data)):
+            logger.debug('duplicate message ignored: %s' % message)
+            return
+        logger.info('message: %s' % message)
+        friend = group or user
+        received = Message(data, chat_type, friend, group, user, msg)
+        return received, message_stream.append(received.__dict__)
+
+
+def receive(message):
+    """
+    解析回调消息，见 ``ingest``
+    :param message: 回调消息
+    :return: 空 | 收到的聊天消息
+    """
+    res = ingest(message)
+    if res:
+        return res[0]
+
+
 def local_on_message(message):
     """
     这是消息回调函数，所有的返回消息都在这里接收，建议异步处理，防止阻塞
@@ -41,24 +104,12 @@ def local_on_message(message):
     :return:
     """
     try:
-        res = get_friends(message, WXFriend=WXFriend)
-
-        # 判断是否为通讯录消息
-        if res:
-            data, chat_type, group, user, msg = res
-
-            # 解析当前消息收发状态
-            try:
-                send_or_recv = not bool(eval(data.get('send_or_recv', '').split('+', 1)[0]))
-            except:
-                send_or_recv = False
-
-            # 判断为收取消息并时间大于启动时间才会进行回复
-            if send_or_recv and data.get('time') >= START_TIME:
-                logger.info('message: %s' % message)
-                # 异步启动当前注册的事件响应器，插件目录 wechat/plugin/
-                friend = group or user
-                asyncio.run(handle_event(Message(data, chat_type, friend, group, user, msg, WX())))
+        message = receive(message)
+        # 被限流的消息仍在消息流中，只是不分发给事件响应器
+        if message and flood_admit(message, classify(message)):
+            message.wx = WX()
+            # 异步启动当前注册的事件响应器，插件目录 wechat/plugin/
+            asyncio.run(handle_event(message))
 
     except Exception:
         logger.info('on_message monitor failed %s' % traceback.print_exc())
@@ -66,17 +117,50 @@ def local_on_message(message):
 
 @singleton
 class WX:
-    def __init__(self, on_message=local_on_message, on_wx_exit_handle=exit, log=logger):
-        self.wx = WechatPCAPI(on_message=on_message, on_wx_exit_handle=on_wx_exit_handle, log=log)
+    def __init__(self, on_message=local_on_message, on_wx_exit_handle=exit, log=logger, api=WechatPCAPI):
+        """
+        :param on_message: 消息回调函数
+        :param api: 微信接口类，测试时可替换为模拟实现
+        """
+        self.on_message = on_message
+        # 登录前收到回调时唤醒登录检测
+        self._activity = threading.Event()
+        self.wx = api(on_message=self._on_message, on_wx_exit_handle=on_wx_exit_handle, log=log)
+        # 先提供上次的通讯录快照，登录后随回调校正
+        WXFriend.open()
+
+    def _on_message(self, message):
+        if not lifecycle.reached(LOGGED_IN):
+            self._activity.set()
+        self.on_message(message)
 
     def start(self):
+        lifecycle.set(STARTING)
         self.wx.start_wechat(block=True)
         while not self.wx.get_myself():
-            time.sleep(5)
+            self._activity.wait(LOGIN_POLL_INTERVAL)
+            self._activity.clear()
 
         logger.info('登陆成功')
-
-        time.sleep(10)
+        lifecycle.set(LOGGED_IN)
+
+        # 等待登录后的通讯录回调写入完毕，超时或尚未收到回调时先进入降级状态，在后台等待同步完毕后再就绪
+        if contact_ingestor.wait_idle(CONTACT_SYNC_QUIET, CONTACT_SYNC_TIMEOUT, first=CONTACT_SYNC_QUIET):
+            self._contacts_synced()
+        else:
+            logger.warning('contacts not synced yet, running degraded')
+            lifecycle.set(DEGRADED)
+            contact_ingestor.when_idle(CONTACT_SYNC_QUIET, self._contacts_synced)
+
+    def _contacts_synced(self):
+        """通讯录同步完毕，清理快照中已不存在的条目后启动群成员刷新并就绪"""
+        # 等待期间微信已重启时由新的启动流程处理
+        if lifecycle.state not in (LOGGED_IN, DEGRADED):
+            return
+        WXFriend.reconcile()
+        lifecycle.set(CONTACTS_SYNCED)
+        chatroom_members.start()
+        lifecycle.set(READY)
 
     def send_text(self, *args, **kwargs):
         self.wx.send_text(*args, **kwargs)
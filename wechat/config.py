@@ -2,3 +2,47 @@ import datetime
 
 # 服务启动时间
 START_TIME = str(datetime.datetime.now())
+
+# 通讯录快照目录
+CONTACT_SNAPSHOT_DIR = 'data'
+# 通讯录追加日志超过该条数后压缩为快照
+CONTACT_COMPACT_THRESHOLD = 5000
+# 通讯录回调批量写入的单批最大条数及最长等待时间（秒）
+CONTACT_BATCH_SIZE = 500
+CONTACT_BATCH_INTERVAL = 0.2
+# 群成员缓存有效期（秒）
+MEMBER_TTL = 600
+# 群成员后台刷新间隔（秒）及每次最多刷新的群数量
+MEMBER_REFRESH_INTERVAL = 30
+MEMBER_REFRESH_BATCH = 20
+# 群成员请求超时时间（秒），超时后允许再次请求
+MEMBER_REQUEST_TIMEOUT = 30
+# HTTP 接口执行阻塞调用的线程数
+HTTP_WORKERS = 8
+# 批量发送的消息间隔（秒）、单次最多条数及最多保留的任务数
+OUTBOX_SEND_INTERVAL = 0.1
+OUTBOX_MAX_BATCH = 1000
+OUTBOX_MAX_JOBS = 1000
+# 发送队列中最多等待发送的消息数，超出后拒绝新的批量发送
+OUTBOX_MAX_PENDING = 10000
+
+# HTTP 消息流缓冲区保留的消息数，超出后丢弃最早的消息
+MESSAGE_STREAM_SIZE = 1000
+# 长轮询最长等待时间（秒）
+MESSAGE_POLL_TIMEOUT = 30
+# SSE 心跳间隔（秒）
+MESSAGE_SSE_HEARTBEAT = 15
+# websocket 单个客户端未发出数据上限（字节），超出后按 WS_SLOW_POLICY 处理慢客户端：
+# drop_oldest 缓存待发送消息并丢弃最早的，disconnect 断开连接，spill 暂停推送并在恢复后从消息流补发；
+# 通讯录、群成员及登录状态推送不丢弃，单独缓存，超出 WS_MAX_BUFFER 时断开连接，客户端重连后重新推送全量状态
+WS_MAX_BUFFER = 4 * 1024 * 1024
+WS_SLOW_POLICY = 'drop_oldest'
+# 慢客户端最多缓存的待发送聊天消息数，缓存的字节数同样不超过 WS_MAX_BUFFER
+WS_BACKLOG_SIZE = 1000
+# 登录检测的兜底轮询间隔（秒），收到微信回调时会立即检测
+LOGIN_POLL_INTERVAL = 1
+# 登录后通讯录回调静默多久（秒）视为同步完毕，以及最长等待时间（秒）
+CONTACT_SYNC_QUIET = 1
+CONTACT_SYNC_TIMEOUT = 10
+# one_click_manager 是否以单事件循环模式运行：HTTP、定时任务及消息分发共用一个事件循环
+SINGLE_LOOP = False
@@ -0,0 +1,483 @@
+"""
+通讯录存储
+==========
+
+通讯录按类型（``person`` | ``chatroom`` | ``gh``）以 ``{wxid: info}`` 的形式保存在内存中，
+同时持久化为本地快照（追加日志 + 定期压缩）。服务重启后先加载上次的快照立即对外提供，
+再随着新的 ``friend::*`` 回调逐条校正，同步结束后清理已不存在的通讯录条目。
+
+登录时的大量通讯录回调经 ``ContactIngestor`` 合并后批量写入，分页用的排序列表随新增及删除增量更新。
+"""
+import bisect
+import json
+import math
+import mmap
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from monitor.contacts import CONTACTS_EVENT
+from monitor.logger import logger
+from .utils import parse_friend, is_friend_message
+
+CONTACT_TYPES = ('person', 'chatroom', 'gh')
+"""支持的通讯录类型"""
+
+SNAPSHOT_FILE = 'contacts.snapshot'
+LOG_FILE = 'contacts.log'
+
+
+def _iter_lines(path: str) -> Iterator[bytes]:
+    """以内存映射的方式逐行读取文件"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                line = line.strip()
+                if line:
+                    yield line
+
+
+class ContactStore:
+    """
+    :说明:
+
+      通讯录存储，按类型提供 ``store.person`` ``store.chatroom`` ``store.gh`` 字典，
+      所有写入需通过 ``upsert`` / ``remove`` 以便记录到追加日志中。
+
+    :参数:
+
+      * ``path: Optional[str]``: 快照目录，为空时不进行持久化
+      * ``compact_threshold: int``: 追加日志条数超过该值时压缩为快照
+    """
+
+    def __init__(self, path: Optional[str] = None, compact_threshold: int = 5000):
+        self.person: Dict[str, Dict[str, Any]] = {}
+        self.chatroom: Dict[str, Dict[str, Any]] = {}
+        self.gh: Dict[str, Dict[str, Any]] = {}
+
+        self.path = path
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.RLock()
+        self._log = None
+        self._log_entries = 0
+        self._opened = False
+        # 从快照中加载但本次启动后尚未收到回调确认的条目
+        self._stale: Dict[str, Set[str]] = {type_: set() for type_ in CONTACT_TYPES}
+        self._received = False
+        self._synced = False
+        # 按 wxid 排序的列表，用于分页；加载快照后重建一次，之后随新增及删除增量更新
+        self._sorted_ids: Dict[str, List[str]] = {type_: [] for type_ in CONTACT_TYPES}
+        self._dirty = True
+        self._listeners: List[Callable[[Dict[str, Any]], Any]] = []
+        # 每次通讯录内容变化递增，与进程启动时间共同用于缓存校验
+        self.version = 0
+        self._epoch = int(time.time())
+
+    def __repr__(self) -> str:
+        return (f"<ContactStore path={self.path}, "
+                f"{', '.join(f'{t}={len(getattr(self, t))}' for t in CONTACT_TYPES)}>")
+
+    @property
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.path, SNAPSHOT_FILE)
+
+    @property
+    def _log_path(self) -> str:
+        return os.path.join(self.path, LOG_FILE)
+
+    def open(self) -> None:
+        """加载本地快照及追加日志，重复调用无效"""
+        with self._lock:
+            if self._opened or not self.path:
+                return
+            self._opened = True
+            os.makedirs(self.path, exist_ok=True)
+
+            for line in _iter_lines(self._snapshot_path):
+                try:
+                    type_, wxid, info = json.loads(line)
+                except ValueError:
+                    logger.warning('contact snapshot line broken, ignored')
+                    continue
+                self.of_type(type_)[wxid] = info
+
+            for line in _iter_lines(self._log_path):
+                try:
+                    op, type_, wxid, *info = json.loads(line)
+                except ValueError:
+                    # 进程异常退出时最后一行可能写入不完整
+                    logger.warning('contact log line broken, ignored')
+                    continue
+                self._log_entries += 1
+                if op == 'u':
+                    self.of_type(type_)[wxid] = info[0]
+                else:
+                    self.of_type(type_).pop(wxid, None)
+
+            for type_ in CONTACT_TYPES:
+                self._stale[type_] = set(getattr(self, type_))
+            self._dirty = True
+            logger.info(f'contact snapshot loaded {self}')
+
+            if self._log_entries >= self.compact_threshold:
+                self.compact()
+            else:
+                self._log = open(self._log_path, 'a', encoding='utf-8')
+
+    def close(self) -> None:
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
+
+    @property
+    def etag(self) -> str:
+        """当前通讯录版本标识"""
+        return f'{self._epoch:x}-{self.version}'
+
+    def of_type(self, type_: str) -> Dict[str, Dict[str, Any]]:
+        """获取指定类型的通讯录字典"""
+        if type_ not in CONTACT_TYPES:
+            raise KeyError(f'Unknown contact type {type_}')
+        return getattr(self, type_)
+
+    def _write(self, *entries: Tuple[Any, ...]) -> None:
+        if not self._log or not entries:
+            return
+        self._log.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+        self._log.flush()
+        self._log_entries += len(entries)
+        if self._log_entries >= self.compact_threshold:
+            self.compact()
+
+    def sorted_ids(self, type_: str) -> List[str]:
+        """获取指定类型按 wxid 排序的列表"""
+        with self._lock:
+            if self._dirty:
+                for contact_type in CONTACT_TYPES:
+                    self._sorted_ids[contact_type] = sorted(getattr(self, contact_type))
+                self._dirty = False
+            return self._sorted_ids[type_]
+
+    def _index_add(self, type_: str, wxid: str) -> None:
+        if not self._dirty:
+            bisect.insort(self._sorted_ids[type_], wxid)
+
+    def _index_remove(self, type_: str, wxid: str) -> None:
+        if not self._dirty:
+            ids = self._sorted_ids[type_]
+            index = bisect.bisect_left(ids, wxid)
+            if index < len(ids) and ids[index] == wxid:
+                del ids[index]
+
+    def page(
+            self,
+            type_: str,
+            cursor: Optional[str] = None,
+            limit: Optional[int] = None,
+            fields: Optional[Iterable[str]] = None,
+    ) -> Tuple[Dict[str, Dict[str, Any]], Optional[str], str]:
+        """
+        :说明:
+
+          按 wxid 顺序分页获取通讯录
+
+        :参数:
+
+          * ``type_: str``: 通讯录类型
+          * ``cursor: Optional[str]``: 上一页最后一个 wxid，为空时从头开始
+          * ``limit: Optional[int]``: 每页条数，为空时返回全部
+          * ``fields: Optional[Iterable[str]]``: 返回字段，为空时返回全部字段
+
+        :返回:
+
+          - ``Tuple[Dict[str, Dict[str, Any]], Optional[str], str]``: 当前页、下一页游标、通讯录版本标识
+        """
+        with self._lock:
+            contacts = self.of_type(type_)
+            ids = self.sorted_ids(type_)
+            start = bisect.bisect_right(ids, cursor) if cursor else 0
+            end = len(ids) if limit is None else min(start + limit, len(ids))
+            fields = tuple(fields) if fields else None
+            page = {}
+            for wxid in ids[start:end]:
+                info = contacts[wxid]
+                page[wxid] = {k: info.get(k) for k in fields} if fields else dict(info)
+            next_cursor = ids[end - 1] if end < len(ids) else None
+            return page, next_cursor, self.etag
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], Any]) -> None:
+        """
+        :说明:
+
+          订阅通讯录变化，每次变化以 ``{'event': 'contacts', 'version': int, 'deltas': [...]}`` 的形式回调，
+          ``deltas`` 中每项为 ``{'op': 'add' | 'update' | 'remove', 'type': str, 'wxid': str, 'info': dict}``。
+          回调在写入线程中同步执行，应尽快返回。
+
+        :参数:
+
+          * ``callback: Callable[[Dict[str, Any]], Any]``: 回调函数
+        """
+        self._listeners.append(callback)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取当前全量通讯录，结构与变化回调一致，``snapshot`` 为 ``True``"""
+        with self._lock:
+            return {
+                'event': CONTACTS_EVENT,
+                'snapshot': True,
+                'version': self.version,
+                'contacts': {type_: dict(getattr(self, type_)) for type_ in CONTACT_TYPES},
+            }
+
+    def _commit(self, entries: List[Tuple[Any, ...]], deltas: List[Dict[str, Any]]) -> None:
+        """记录一批变化: 更新版本、写入追加日志并通知订阅者"""
+        self.version += 1
+        self._write(*entries)
+        if not self._listeners:
+            return
+        frame = {'event': CONTACTS_EVENT, 'version': self.version, 'deltas': deltas}
+        for listener in self._listeners:
+            try:
+                listener(frame)
+            except Exception as e:
+                logger.opt(exception=e).error(f'contact listener {listener} failed')
+
+    def upsert(self, type_: str, wxid: str, info: Dict[str, Any]) -> bool:
+        """
+        :说明:
+
+          新增或更新一条通讯录信息
+
+        :返回:
+
+          - ``bool``: 内容是否发生变化
+        """
+        return bool(self.upsert_many(((type_, wxid, info),)))
+
+    def upsert_many(self, entries: Iterable[Tuple[str, str, Dict[str, Any]]]) -> int:
+        """
+        :说明:
+
+          批量新增或更新通讯录信息，日志一次写入，新增的条目插入排序列表
+
+        :参数:
+
+          * ``entries: Iterable[Tuple[str, str, Dict[str, Any]]]``: ``(类型, wxid, 通讯录信息)`` 列表
+
+        :返回:
+
+          - ``int``: 发生变化的条目数
+        """
+        with self._lock:
+            changed, deltas = [], []
+            for type_, wxid, info in entries:
+                contacts = self.of_type(type_)
+                self._stale[type_].discard(wxid)
+                old = contacts.get(wxid)
+                if old == info:
+                    continue
+                contacts[wxid] = info
+                if old is None:
+                    self._index_add(type_, wxid)
+                changed.append(('u', type_, wxid, info))
+                deltas.append({'op': 'add' if old is None else 'update', 'type': type_, 'wxid': wxid, 'info': info})
+            self._received = True
+            if changed:
+                self._commit(changed, deltas)
+            return len(changed)
+
+    def remove(self, type_: str, wxid: str) -> bool:
+        """删除一条通讯录信息，返回是否存在"""
+        return bool(self.remove_many(((type_, wxid),)))
+
+    def remove_many(self, entries: Iterable[Tuple[str, str]]) -> int:
+        """批量删除通讯录信息，返回删除的条目数"""
+        with self._lock:
+            changed, deltas = [], []
+            for type_, wxid in entries:
+                contacts = self.of_type(type_)
+                self._stale[type_].discard(wxid)
+                if contacts.pop(wxid, None) is None:
+                    continue
+                self._index_remove(type_, wxid)
+                changed.append(('d', type_, wxid))
+                deltas.append({'op': 'remove', 'type': type_, 'wxid': wxid, 'info': None})
+            if changed:
+                self._commit(changed, deltas)
+            return len(changed)
+
+    def reconcile(self) -> int:
+        """
+        :说明:
+
+          通讯录同步完毕后调用，删除快照中存在但本次同步未再出现的条目。
+          本次启动未收到任何通讯录回调时不做处理，防止误删。
+
+        :返回:
+
+          - ``int``: 删除的条目数
+        """
+        with self._lock:
+            if self._synced or not self._received:
+                return 0
+            self._synced = True
+            removed = self.remove_many(
+                [(type_, wxid) for type_ in CONTACT_TYPES for wxid in self._stale[type_]])
+            if removed:
+                logger.info(f'contact reconcile removed {removed} stale contacts')
+            return removed
+
+    def compact(self) -> None:
+        """将当前通讯录写为快照并清空追加日志"""
+        with self._lock:
+            if not self.path:
+                return
+            tmp_path = self._snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for type_ in CONTACT_TYPES:
+                    for wxid, info in getattr(self, type_).items():
+                        f.write(json.dumps((type_, wxid, info), ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self._snapshot_path)
+
+            if self._log:
+                self._log.close()
+            self._log = open(self._log_path, 'w', encoding='utf-8')
+            self._log_entries = 0
+            logger.debug(f'contact snapshot compacted {self}')
+
+
+class ContactIngestor:
+    """
+    :说明:
+
+      通讯录回调批量写入器。回调线程只需将通讯录消息放入队列，
+      由后台线程解析并按 ``(类型, wxid)`` 合并后批量写入 ``ContactStore``，
+      避免登录时的大量通讯录回调与实时消息分发争抢回调线程。
+
+    :参数:
+
+      * ``store: ContactStore``: 通讯录存储
+      * ``batch_size: int``: 单批最大条数
+      * ``interval: float``: 单批最长等待时间（秒）
+    """
+
+    def __init__(self, store: ContactStore, batch_size: int = 500, interval: float = 0.2):
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 最近一次收到通讯录回调的时间及正在写入的条数，用于判断登录后通讯录是否同步完毕
+        self._last_offer: Optional[float] = None
+        self._flushing = 0
+        self._idle = threading.Condition()
+
+    def offer(self, message: Dict[str, Any]) -> bool:
+        """
+        :说明:
+
+          通讯录消息放入批量写入队列，非通讯录消息不做处理
+
+        :返回:
+
+          - ``bool``: 是否为通讯录消息
+        """
+        if not is_friend_message(message):
+            return False
+        if not self._thread:
+            self._start()
+        self._last_offer = time.monotonic()
+        self._queue.put(message)
+        return True
+
+    def wait_idle(self, quiet: float, timeout: float, first: Optional[float] = None) -> bool:
+        """
+        :说明:
+
+          等待通讯录同步完毕：已收到通讯录回调、``quiet`` 秒内无新的回调且队列已全部写入
+
+        :参数:
+
+          * ``quiet: float``: 无新回调多久视为同步完毕（秒）
+          * ``timeout: float``: 最长等待时间（秒）
+          * ``first: Optional[float]``: 等待第一条回调的最长时间（秒），为空时与 ``timeout`` 相同
+
+        :返回:
+
+          - ``bool``: 超时前是否同步完毕，未收到任何回调时为 ``False``
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        if first is not None:
+            first = start + first
+        with self._idle:
+            while True:
+                now = time.monotonic()
+                last = self._last_offer
+                if last is not None and now - last >= quiet and self._queue.empty() and not self._flushing:
+                    return True
+                if now >= deadline or (last is None and first is not None and now >= first):
+                    return False
+                wait = quiet if last is None else last + quiet - now
+                self._idle.wait(min(max(wait, 0.01), deadline - now))
+
+    def when_idle(self, quiet: float, callback: Callable[[], Any]) -> None:
+        """后台等待通讯录同步完毕后调用 ``callback``"""
+        def wait():
+            self.wait_idle(quiet, math.inf)
+            callback()
+
+        threading.Thread(target=wait, name='contact-sync', daemon=True).start()
+
+    def _start(self) -> None:
+        with self._lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='contact-ingestor', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            self._flushing = 1
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.flush(batch)
+            finally:
+                with self._idle:
+                    self._flushing = 0
+                    self._idle.notify_all()
+
+    def flush(self, batch: List[Dict[str, Any]]) -> None:
+        """合并并写入一批通讯录消息"""
+        entries: Dict[Tuple[str, str], Tuple[str, str, Dict[str, Any]]] = {}
+        for message in batch:
+            try:
+                friend = parse_friend(message)
+            except Exception as e:
+                logger.warning(f'contact message parse failed {e}')
+                continue
+            if friend and friend[0] in CONTACT_TYPES:
+                entries[friend[:2]] = friend
+        try:
+            changed = self.store.upsert_many(entries.values())
+        except Exception as e:
+            logger.opt(exception=e).error('contact batch upsert failed')
+            return
+        logger.debug(f'contact batch received={len(batch)} changed={changed}')
@@ -0,0 +1,191 @@
+"""
+群成员缓存
+==========
+
+``WX.get_member_of_chatroom`` 只发起请求，结果通过 ``member::*`` 回调异步返回。
+本模块缓存 群 -> 成员 以及 成员 -> 群 两个方向的索引，缓存过期后在后台刷新，
+同一个群同时只会存在一个未完成的请求。
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+
+from monitor.contacts import MEMBERS_EVENT
+from monitor.logger import logger
+from .utils import is_member_message, parse_members
+
+
+class MembershipCache:
+    """
+    :说明:
+
+      群成员缓存
+
+    :参数:
+
+      * ``fetch: Callable[[str], Any]``: 请求群成员的函数，结果需通过 ``offer`` 回填
+      * ``ttl: float``: 缓存有效期（秒）
+      * ``request_timeout: float``: 请求超时时间（秒），超时后允许再次请求
+      * ``refresh_interval: float``: 后台刷新间隔（秒）
+      * ``refresh_batch: int``: 每次后台刷新最多请求的群数量
+      * ``chatrooms: Optional[Callable[[], Iterable[str]]]``: 需要预热的群列表
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[str], Any],
+            ttl: float = 600,
+            request_timeout: float = 30,
+            refresh_interval: float = 30,
+            refresh_batch: int = 20,
+            chatrooms: Optional[Callable[[], Iterable[str]]] = None,
+    ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.request_timeout = request_timeout
+        self.refresh_interval = refresh_interval
+        self.refresh_batch = refresh_batch
+        self.chatrooms_source = chatrooms
+
+        self._members: Dict[str, FrozenSet[str]] = {}
+        self._rooms: Dict[str, Set[str]] = {}
+        self._updated: Dict[str, float] = {}
+        self._pending: Dict[str, float] = {}
+        self._listeners: List[Callable[[Dict[str, Any]], Any]] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def __repr__(self) -> str:
+        return f"<MembershipCache chatrooms={len(self._members)}, pending={len(self._pending)}>"
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], Any]) -> None:
+        """
+        订阅群成员变化，回调参数为 ``{'event': 'members', 'chatroom': str, 'members': List[str]}``
+        """
+        self._listeners.append(callback)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取当前全部群成员缓存，``snapshot`` 为 ``True``"""
+        with self._lock:
+            return {
+                'event': MEMBERS_EVENT,
+                'snapshot': True,
+                'members': {chatroom: list(members) for chatroom, members in self._members.items()},
+            }
+
+    def offer(self, message: Dict[str, Any]) -> bool:
+        """
+        :说明:
+
+          处理群成员回调，非群成员消息不做处理
+
+        :返回:
+
+          - ``bool``: 是否为群成员消息
+        """
+        if not is_member_message(message):
+            return False
+        try:
+            res = parse_members(message)
+        except Exception as e:
+            logger.warning(f'member message parse failed {e}')
+            return True
+        if res:
+            self.update(*res)
+        return True
+
+    def update(self, chatroom: str, members: Iterable[str]) -> None:
+        """写入一个群的全部成员"""
+        members = frozenset(members)
+        with self._lock:
+            old = self._members.get(chatroom, frozenset())
+            for wxid in old - members:
+                rooms = self._rooms.get(wxid)
+                if rooms:
+                    rooms.discard(chatroom)
+                    if not rooms:
+                        del self._rooms[wxid]
+            for wxid in members - old:
+                self._rooms.setdefault(wxid, set()).add(chatroom)
+            self._members[chatroom] = members
+            self._updated[chatroom] = time.monotonic()
+            self._pending.pop(chatroom, None)
+            changed = old != members
+        if changed:
+            frame = {'event': MEMBERS_EVENT, 'chatroom': chatroom, 'members': list(members)}
+            for listener in self._listeners:
+                try:
+                    listener(frame)
+                except Exception as e:
+                    logger.opt(exception=e).error(f'member listener {listener} failed')
+
+    def members(self, chatroom: str) -> FrozenSet[str]:
+        """获取群成员，缓存过期或不存在时在后台刷新"""
+        members = self._members.get(chatroom)
+        if members is None or self._expired(chatroom):
+            self.refresh(chatroom)
+        return members or frozenset()
+
+    def chatrooms(self, wxid: str) -> FrozenSet[str]:
+        """获取成员所在的所有已缓存的群"""
+        return frozenset(self._rooms.get(wxid, ()))
+
+    def is_member(self, chatroom: str, wxid: str) -> bool:
+        return wxid in self.members(chatroom)
+
+    def cached(self, chatroom: str) -> bool:
+        return chatroom in self._members
+
+    def _expired(self, chatroom: str) -> bool:
+        updated = self._updated.get(chatroom)
+        return updated is None or time.monotonic() - updated > self.ttl
+
+    def refresh(self, chatroom: str) -> bool:
+        """
+        :说明:
+
+          请求刷新群成员，同一个群未超时的请求只会发送一次
+
+        :返回:
+
+          - ``bool``: 是否发送了新的请求
+        """
+        now = time.monotonic()
+        with self._lock:
+            requested = self._pending.get(chatroom)
+            if requested is not None and now - requested < self.request_timeout:
+                return False
+            self._pending[chatroom] = now
+        try:
+            self.fetch(chatroom)
+        except Exception as e:
+            logger.opt(exception=e).error(f'request members of {chatroom} failed')
+            with self._lock:
+                self._pending.pop(chatroom, None)
+            return False
+        return True
+
+    def start(self) -> None:
+        """启动后台刷新线程，重复调用无效"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='member-refresher', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                chatrooms = set(self._members)
+                if self.chatrooms_source:
+                    chatrooms.update(self.chatrooms_source())
+                stale = [chatroom for chatroom in chatrooms if self._expired(chatroom)]
+                # 优先刷新从未缓存及最久未刷新的群
+                stale.sort(key=lambda chatroom: self._updated.get(chatroom, 0))
+                sent = 0
+                for chatroom in stale:
+                    if sent >= self.refresh_batch:
+                        break
+                    sent += self.refresh(chatroom)
+            except Exception as e:
+                logger.opt(exception=e).error('member refresh failed')
+            time.sleep(self.refresh_interval)
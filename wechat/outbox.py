@@ -0,0 +1,135 @@
+"""
+发送队列
+========
+
+批量发送的消息进入发送队列，由后台线程依次调用微信接口发送，
+每次批量发送对应一个任务，可通过任务 id 查询每条消息的发送状态及耗时。
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from monitor.logger import logger
+
+QUEUED = 'queued'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class SendJob:
+    """批量发送任务"""
+
+    __slots__ = ('id', 'created', 'items', 'done')
+
+    def __init__(self, items: Iterable[Tuple[str, str]]):
+        self.id = uuid.uuid4().hex
+        self.created = time.time()
+        self.items: List[Dict[str, Any]] = [
+            {'friend_id': friend_id, 'msg': msg, 'status': QUEUED, 'latency': None, 'error': None}
+            for friend_id, msg in items
+        ]
+        self.done = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.done >= len(self.items)
+
+    def to_dict(self) -> Dict[str, Any]:
+        counts = {QUEUED: 0, SENT: 0, FAILED: 0}
+        for item in self.items:
+            counts[item['status']] += 1
+        return {
+            'job_id': self.id,
+            'created': int(self.created),
+            'total': len(self.items),
+            'finished': self.finished,
+            **counts,
+            'items': [dict(item) for item in self.items],
+        }
+
+
+class Outbox:
+    """
+    :说明:
+
+      发送队列，后台线程按入队顺序发送
+
+    :参数:
+
+      * ``send: Callable[[str, str], Any]``: 发送函数，参数为 ``(friend_id, msg)``
+      * ``interval: float``: 两条消息之间的发送间隔（秒）
+      * ``max_jobs: int``: 最多保留的任务数，超出后丢弃最早的已完成任务
+      * ``max_pending: int``: 最多等待发送的消息数，超出后拒绝新的任务
+    """
+
+    def __init__(self, send: Callable[[str, str], Any], interval: float = 0.1, max_jobs: int = 1000,
+                 max_pending: int = 10000):
+        self.send = send
+        self.interval = interval
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        # 已入队但尚未发送的消息数
+        self.pending = 0
+        self._jobs: "OrderedDict[str, SendJob]" = OrderedDict()
+        self._queue: "queue.SimpleQueue[Tuple[SendJob, int, float]]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, items: Iterable[Tuple[str, str]]) -> Optional[SendJob]:
+        """
+        :说明:
+
+          批量消息入队
+
+        :返回:
+
+          - ``Optional[SendJob]``: 发送任务，等待发送的消息数将超出 ``max_pending`` 时为 ``None``
+        """
+        job = SendJob(items)
+        with self._lock:
+            if self.pending + len(job.items) > self.max_pending:
+                logger.warning(f'outbox full, {self.pending} pending, batch of {len(job.items)} rejected')
+                return None
+            self.pending += len(job.items)
+            self._jobs[job.id] = job
+            self._evict()
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+                self._thread.start()
+        now = time.monotonic()
+        for index in range(len(job.items)):
+            self._queue.put((job, index, now))
+        return job
+
+    def get(self, job_id: str) -> Optional[SendJob]:
+        return self._jobs.get(job_id)
+
+    def _evict(self) -> None:
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished]:
+            del self._jobs[job_id]
+            if len(self._jobs) <= self.max_jobs:
+                break
+
+    def _run(self) -> None:
+        while True:
+            job, index, queued = self._queue.get()
+            item = job.items[index]
+            try:
+                self.send(item['friend_id'], item['msg'])
+                item['status'] = SENT
+            except Exception as e:
+                logger.opt(exception=e).error(f'outbox send to {item["friend_id"]} failed')
+                item['status'] = FAILED
+                item['error'] = str(e)
+            # 从入队到发送完成的耗时（毫秒）
+            item['latency'] = round((time.monotonic() - queued) * 1000, 1)
+            job.done += 1
+            with self._lock:
+                self.pending -= 1
+            if self.interval:
+                time.sleep(self.interval)
@@ -1,14 +1,13 @@
 import json
 import random
 
-import aiohttp
-
 from monitor.config import TULING_API_KEY, TULING_URL
 from monitor.plugin import on_regex
 from monitor.rule import to_me
-from monitor.utils import try_except, MD5
+from monitor.utils import try_except, MD5, http_session
 
-tuling = on_regex(r'.+', rule=to_me(), priority=6)
+# 连续发送的多条消息合并后只请求一次
+tuling = on_regex(r'.+', rule=to_me(), priority=6, debounce=1.5)
 tuling.__doc__ = '智能聊天'
 # 异常回复消息元组
 Exception_reply = (
@@ -35,7 +34,7 @@ async def get_tuling_reply(user_id, msg):
     }
     reply_exception = random.choice(Exception_reply)
     resp_payload = None
-    async with aiohttp.ClientSession() as sess:
+    async with http_session() as sess:
         async with sess.post(TULING_URL, json=request_json) as resp:
             if resp.status == 200:
                 resp_payload = json.loads(await resp.text())
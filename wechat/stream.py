@@ -0,0 +1,124 @@
+"""
+消息流
+======
+
+收到的聊天消息依次写入定长环形缓冲区，每条消息分配一个递增的序号。
+HTTP 客户端通过序号作为游标，以 SSE 或长轮询的方式断点续读，
+游标早于缓冲区中最早的消息时返回丢失的条数。
+"""
+import asyncio
+import threading
+from collections import deque
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class MessageStream:
+    """
+    :说明:
+
+      消息环形缓冲区，``append`` 可在任意线程调用，``wait`` 需在事件循环中调用
+
+    :参数:
+
+      * ``size: int``: 缓冲区最多保留的消息数
+    """
+
+    def __init__(self, size: int = 1000):
+        self.size = size
+        self.seq = 0
+        self._buffer: "deque[Dict[str, Any]]" = deque(maxlen=size)
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"<MessageStream seq={self.seq}, buffered={len(self._buffer)}>"
+
+    @property
+    def first(self) -> int:
+        """缓冲区中最早一条消息的序号，缓冲区为空时为下一条消息的序号"""
+        buffer = self._buffer
+        return buffer[0]['seq'] if buffer else self.seq + 1
+
+    def append(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """写入一条消息，返回带有 ``seq`` 序号的消息"""
+        with self._lock:
+            self.seq += 1
+            message = dict(message, seq=self.seq)
+            self._buffer.append(message)
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return message
+
+    def read(
+            self,
+            cursor: int,
+            limit: int = 100,
+            filter_: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> Tuple[List[Dict[str, Any]], int, int]:
+        """
+        :说明:
+
+          读取游标之后的消息
+
+        :参数:
+
+          * ``cursor: int``: 已读取的最后一条消息的序号
+          * ``limit: int``: 最多返回的条数
+          * ``filter_: Optional[Callable[[Dict[str, Any]], bool]]``: 消息过滤函数
+
+        :返回:
+
+          - ``List[Dict[str, Any]]``: 消息列表
+          - ``int``: 新的游标
+          - ``int``: 游标过旧而丢失的消息条数
+        """
+        with self._lock:
+            # 游标大于当前序号说明服务已重启，从头读取
+            if cursor > self.seq:
+                cursor = 0
+            first = self.first
+            lost = max(first - cursor - 1, 0)
+            # 序号连续，可直接计算游标在缓冲区中的位置
+            start = max(cursor + 1 - first, 0)
+            buffered = list(islice(self._buffer, start, None))
+            last = self.seq
+        messages = []
+        for message in buffered:
+            if filter_ is None or filter_(message):
+                messages.append(message)
+                if len(messages) >= limit:
+                    return messages, message['seq'], lost
+        return messages, max(cursor, last), lost
+
+    async def wait(self, cursor: int, timeout: float) -> bool:
+        """
+        :说明:
+
+          等待游标之后出现新消息
+
+        :返回:
+
+          - ``bool``: 超时前是否有新消息
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self.seq > cursor:
+                return True
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
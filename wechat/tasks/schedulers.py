@@ -1,3 +1,4 @@
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from wechat.tasks import call_back
@@ -9,3 +10,17 @@ def add_task(callback, hour, minute, *args, **kwargs):
 
 
 scheduler = BackgroundScheduler()
+
+
+def attach_loop(loop):
+    """
+    切换为在指定事件循环中运行的调度器，已添加的任务一并迁移，需在调度器启动前调用
+    :param loop: asyncio 事件循环
+    :return: 新的调度器
+    """
+    global scheduler
+    loop_scheduler = AsyncIOScheduler(event_loop=loop)
+    for job in scheduler.get_jobs():
+        loop_scheduler.add_job(job.func, job.trigger, args=job.args, kwargs=job.kwargs, id=job.id, name=job.name)
+    scheduler = loop_scheduler
+    return scheduler
@@ -1,8 +1,67 @@
 import warnings
 
+from .config import START_TIME
+
 warnings.filterwarnings('ignore')
 
 
+def parse_friend(message):
+    """
+    解析通讯录消息
+    :param message: 回调消息
+    :return: 空 | (通讯录类型, wxid, 通讯录信息)
+    """
+    friend_type = message.get('type', '').rsplit('::', 1)[-1]
+    data = message.get('data')
+    if not data:
+        return
+    if friend_type == 'person':
+        _id = 'wx'
+        _name = 'wx_nick'
+    else:
+        _id = friend_type
+        _name = friend_type + '_'
+    _id = data.get('%s_id' % _id)
+    _name = data.get('%sname' % _name)
+    remark_name = data.get('remark_name')
+    return friend_type, _id, {'name': _name, 'type': friend_type, 'remark_name': remark_name}
+
+
+def is_friend_message(message):
+    """是否为通讯录消息"""
+    msg_type = message.get('type')
+    return bool(msg_type) and msg_type.startswith('friend::')
+
+
+def is_member_message(message):
+    """是否为群成员消息"""
+    msg_type = message.get('type')
+    return bool(msg_type) and msg_type.startswith('member::')
+
+
+def parse_members(message):
+    """
+    解析群成员消息
+    :param message: 回调消息
+    :return: 空 | (群 id, 成员 wxid 列表)
+    """
+    data = message.get('data')
+    if not data:
+        return
+    chatroom = data.get('chatroom_id') or data.get('chatroom_wxid')
+    members = data.get('member_list') or data.get('members') or data.get('member') or []
+    if isinstance(members, str):
+        members = members.split(',')
+    wxids = []
+    for member in members:
+        if isinstance(member, dict):
+            member = member.get('wx_id') or member.get('wxid') or member.get('member_wxid')
+        if member:
+            wxids.append(member)
+    if chatroom:
+        return chatroom, wxids
+
+
 def get_friends(message, WXFriend):
     """
     获取通讯录信息
@@ -17,19 +76,9 @@ def get_friends(message, WXFriend):
     if msg_type:
 
         if msg_type.startswith('friend::'):  # 通讯录类型
-            friend_type = msg_type.rsplit('::', 1)[-1]
-            if friend_type == 'person':
-                _id = 'wx'
-                _name = 'wx_nick'
-            else:
-                _id = friend_type
-                _name = friend_type + '_'
-            if data:
-                _id = data.get('%s_id' % _id)
-                _name = data.get('%sname' % _name)
-                remark_name = data.get('remark_name')
-                getattr(WXFriend, friend_type)[_id] = {'name': _name, 'type': friend_type,
-                                                       'remark_name': remark_name}
+            friend = parse_friend(message)
+            if friend:
+                WXFriend.upsert(*friend)
         else:
 
             msg = data.get('msg')
@@ -38,3 +87,26 @@ def get_friends(message, WXFriend):
                 group = data.get('from_chatroom_wxid')
                 user = data.get('from_member_wxid', data.get('from_wxid'))
                 return data, chat_type, group, user, msg
+
+
+def get_received(message):
+    """
+    获取启动后收到的聊天消息
+    :param message: 回调消息
+    :return: 空 | (data, chat_type, group, user, msg)
+    """
+    if is_friend_message(message):
+        return
+    res = get_friends(message, WXFriend=None)
+    if not res:
+        return
+    data = res[0]
+    # 解析当前消息收发状态
+    try:
+        send_or_recv = not bool(eval(data.get('send_or_recv', '').split('+', 1)[0]))
+    except:
+        send_or_recv = False
+
+    # 判断为收取消息并时间大于启动时间才会进行回复
+    if send_or_recv and data.get('time') >= START_TIME:
+        return res